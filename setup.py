@@ -34,6 +34,8 @@ setup(
         'console_scripts': [
             'review-gator = '
             'review_gator.review_gator:main',
+            'review-gator-benchmark = '
+            'review_gator.benchmark:main',
         ],
     },
 )
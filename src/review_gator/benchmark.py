@@ -0,0 +1,598 @@
+"""
+Benchmark aggregate_reviews against generated github and launchpad data.
+
+Fake providers stand in for the github client and the launchpad sessions,
+serving N repositories or branches of M pull requests or merge proposals
+with K reviews and comments each, so that nothing touches the network.
+Every call to a fake API waits for the configured latency and is recorded
+in the instrumentation stats, as the requests of the real clients are.
+
+Each scenario measures the time of aggregate_reviews, the API calls made,
+the time spent in get_repo_data and render, the peak memory allocated, the
+memory still held by the collected repos once the providers are gone and
+the size of the report written. The results are compared with a baseline
+stored by an earlier run with --save-baseline.
+"""
+
+import collections
+import contextlib
+import datetime
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+import pytz
+
+from . import instrumentation
+from . import rendering
+from . import review_gator
+from . import sessions as api_sessions
+from .http_cache import CacheStats
+
+SCENARIOS = ('github', 'lp-git', 'launchpad-branches', 'owner-sweep')
+DEFAULT_BASELINE = 'review-gator-benchmark.json'
+BASELINE_VERSION = 1
+# Measurements compared with the baseline; higher is worse for each
+MEASUREMENTS = ('aggregate_time', 'get_repo_data_time', 'render_time',
+                'api_calls', 'peak_memory', 'model_memory', 'output_size')
+LP_API = 'https://api.launchpad.net/devel/'
+LP_WEB = 'https://code.launchpad.net/'
+# Pull requests per page of the fake github list calls
+GITHUB_PAGE_SIZE = 30
+REVIEW_STATES = ('APPROVED', 'CHANGES_REQUESTED', 'COMMENTED')
+VOTES = ('Approve', 'Needs Fixing', 'Abstain')
+
+
+class FakeObject(object):
+    """An API object with the given attributes."""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class FakeAPI(object):
+    """Record the calls of a fake provider, each taking latency seconds."""
+
+    def __init__(self, provider, latency):
+        self.provider = provider
+        self.latency = latency
+
+    def call(self, resource, result=None):
+        """Record a call about resource and return result."""
+        if self.latency:
+            time.sleep(self.latency)
+        instrumentation.get_stats().record_call(self.provider, resource,
+                                                self.latency)
+        return result
+
+
+class FakeGithubPull(object):
+    """A github pull request with reviews and comments."""
+
+    def __init__(self, api, key, number, reviews, date):
+        self.api = api
+        self.key = key
+        self.number = number
+        self.html_url = 'https://github.com/{}/pull/{}'.format(key, number)
+        self.title = 'Pull request {} of {}'.format(number, key)
+        self.user = FakeObject(login='author{}'.format(number % 7))
+        self.state = 'open'
+        self.created_at = date
+        self.updated_at = date + datetime.timedelta(hours=reviews)
+        self.reviews = reviews
+
+    def get_reviews(self):
+        return self.api.call(self.key, [FakeObject(
+            state=REVIEW_STATES[i % len(REVIEW_STATES)],
+            user=FakeObject(login='reviewer{}'.format(i)),
+            html_url='{}#review-{}'.format(self.html_url, i),
+            submitted_at=self.created_at + datetime.timedelta(hours=i))
+            for i in range(self.reviews)])
+
+    def get_comments(self):
+        return self.api.call(self.key, [FakeObject(
+            created_at=self.created_at + datetime.timedelta(minutes=i))
+            for i in range(self.reviews)])
+
+    def get_issue_comments(self):
+        return self.get_comments()
+
+
+class FakeGithubRepo(object):
+
+    def __init__(self, api, key, pulls):
+        self.api = api
+        self.full_name = key
+        self.html_url = 'https://github.com/{}'.format(key)
+        self.ssh_url = 'git@github.com:{}.git'.format(key)
+        self.pulls = pulls
+
+    def get_pulls(self, **kwargs):
+        pages = max(1, -(-len(self.pulls) // GITHUB_PAGE_SIZE))
+        for _ in range(pages):
+            self.api.call(self.full_name)
+        return iter(self.pulls)
+
+
+class FakeGithub(object):
+    """A github client serving repos repositories of pull_requests pull
+    requests with reviews reviews and comments each, dated with timezone
+    aware datetimes as by PyGithub 2."""
+
+    def __init__(self, repos, pull_requests, reviews, latency, now):
+        self.api = FakeAPI('github', latency)
+        # The rate limit does not reset during a benchmark
+        self.rate_limiting_resettime = int(time.time()) + 60 * 60
+        self.repos = {}
+        for i in range(repos):
+            key = 'bench/repo{}'.format(i)
+            self.repos[key] = FakeGithubRepo(self.api, key, [
+                FakeGithubPull(self.api, key, number, reviews,
+                               now - datetime.timedelta(days=number))
+                for number in range(pull_requests, 0, -1)])
+        self.sources = {'repos': {'bench': dict(
+            (key.split('/')[1], {'review-count': 2}) for key in self.repos)}}
+
+    @property
+    def rate_limiting(self):
+        # Never short of requests, so every repo is fetched
+        return (10 ** 9, 10 ** 9)
+
+    def get_rate_limit(self):
+        # Free, as for github
+        return None
+
+    def get_repo(self, key):
+        return self.api.call(key, self.repos[key])
+
+
+class FakeMergeProposal(object):
+    """A launchpad merge proposal, whose comments, votes and reviewers
+    are loaded lazily as by launchpadlib."""
+
+    def __init__(self, api, target, source_link, number, reviews, date,
+                 git=True):
+        self.api = api
+        self.web_link = '{}/+merge/{}'.format(target.web_link, number)
+        self.self_link = '{}/+merge/{}'.format(target.self_link, number)
+        self.registrant_link = '{}~author{}'.format(LP_API, number % 7)
+        self.queue_status = 'Needs review'
+        self.date_created = date
+        self.description = 'Merge proposal {}\nof {}'.format(
+            number, target.display_name)
+        if git:
+            self.source_git_repository_link = source_link
+            self.source_git_path = 'refs/heads/feature{}'.format(number)
+            self.target_git_repository_link = target.self_link
+            self.target_git_path = 'refs/heads/master'
+            self.source_branch_link = None
+        else:
+            self.source_git_repository_link = None
+            self.source_git_path = None
+            self.target_git_path = None
+            self.source_branch_link = source_link
+            self.target_branch_link = target.self_link
+        self.reviews = reviews
+
+    @property
+    def all_comments(self):
+        return self.api.call(self.self_link, [FakeObject(
+            date_created=self.date_created + datetime.timedelta(minutes=i))
+            for i in range(self.reviews)])
+
+    @property
+    def votes(self):
+        votes = []
+        for i in range(self.reviews):
+            date = self.date_created + datetime.timedelta(hours=i)
+            votes.append(FakeVote(self.api, self.self_link, i, date))
+        return self.api.call(self.self_link, votes)
+
+
+class FakeVote(object):
+
+    def __init__(self, api, link, index, date):
+        self.api = api
+        self.link = link
+        self.index = index
+        self.web_link = '{}/+vote/{}'.format(link, index)
+        self.date_created = date
+        self.comment = None
+        if index % 2:
+            self.comment = FakeObject(vote=VOTES[index % len(VOTES)],
+                                      date_created=date)
+
+    @property
+    def reviewer(self):
+        return self.api.call(self.link, FakeObject(
+            display_name='Reviewer {}'.format(self.index)))
+
+
+class FakeBranch(object):
+    """A launchpad branch or git repository and its merge proposals."""
+
+    def __init__(self, api, path, display_name):
+        self.api = api
+        self.self_link = LP_API + path
+        self.web_link = LP_WEB + path
+        self.display_name = display_name
+        self.merge_proposals = []
+
+    def getMergeProposals(self, status=None):
+        return self.api.call(self.self_link, list(self.merge_proposals))
+
+
+class FakeLaunchpad(object):
+    """A launchpad session over the generated branches, repositories and
+    people."""
+
+    def __init__(self, api):
+        self.api = api
+        self.objects = {}
+        self.by_url = {}
+        self.by_path = {}
+        self.person_branches = collections.defaultdict(list)
+        self.branches = FakeObject(getByUrl=self._get_by_url)
+        self.git_repositories = FakeObject(
+            getByPath=self._get_by_path,
+            getRepositories=self._get_repositories)
+
+    def add_branch(self, path, display_name, owner=None):
+        branch = FakeBranch(self.api, path, display_name)
+        self.objects[branch.self_link] = branch
+        if owner is not None:
+            self.person_branches[owner].append(branch)
+        return branch
+
+    def add_merge_proposal(self, mp):
+        self.objects[mp.self_link] = mp
+
+    def _get_by_url(self, url):
+        return self.api.call(url, self.by_url[url])
+
+    def _get_by_path(self, path):
+        return self.api.call(path, self.by_path[path])
+
+    def _get_repositories(self, target, modified_since_date=None):
+        return target.getBranches()
+
+    def people(self, owner):
+        return FakeObject(name=owner, getBranches=(
+            lambda modified_since=None: self.api.call(
+                '~' + owner, list(self.person_branches[owner]))))
+
+    def load(self, link):
+        return self.api.call(
+            instrumentation.get_launchpad_resource(link), self.objects[link])
+
+
+class FakeLaunchpadSessions(object):
+    """A LaunchpadSessions sharing a single FakeLaunchpad."""
+
+    def __init__(self, lp):
+        self.lp = lp
+        self.stats = CacheStats()
+
+    @contextlib.contextmanager
+    def session(self):
+        yield self.lp
+
+    def reset(self):
+        pass
+
+    def prune(self):
+        pass
+
+
+def get_lp_git(repos, pull_requests, reviews, latency, now):
+    """Return the lp-git sources and launchpad of the lp-git scenario."""
+    lp = FakeLaunchpad(FakeAPI('launchpad', latency))
+    config = {}
+    for i in range(repos):
+        path = '~bench/project{0}/+git/repo{0}'.format(i)
+        repo = lp.add_branch(path, 'lp:' + path)
+        lp.by_path[path] = repo
+        for number in range(pull_requests):
+            source = lp.add_branch('~dev{}/project{}/+git/repo{}'.format(
+                number, i, i), 'source')
+            mp = FakeMergeProposal(lp.api, repo, source.self_link,
+                                   number, reviews,
+                                   now - datetime.timedelta(days=number))
+            repo.merge_proposals.append(mp)
+            lp.add_merge_proposal(mp)
+        config['lp:' + path] = {'review-count': 2}
+    return {'lp-git': {'repos': config, 'owners': {}}}, lp
+
+
+def get_launchpad_branches(repos, pull_requests, reviews, latency, now):
+    """Return the launchpad sources and launchpad of the
+    launchpad-branches scenario."""
+    lp = FakeLaunchpad(FakeAPI('launchpad', latency))
+    config = {}
+    for i in range(repos):
+        path = '~bench/project{}/trunk'.format(i)
+        branch = lp.add_branch(path, 'lp:' + path)
+        url = 'lp:' + path
+        lp.by_url[url] = branch
+        for number in range(pull_requests):
+            source = lp.add_branch('~dev{}/project{}/feature'.format(
+                number, i), 'source')
+            mp = FakeMergeProposal(lp.api, branch, source.self_link,
+                                   number, reviews,
+                                   now - datetime.timedelta(days=number),
+                                   git=False)
+            branch.merge_proposals.append(mp)
+            lp.add_merge_proposal(mp)
+        config[url] = {'review-count': 2}
+    return {'launchpad': {'branches': config, 'owners': {}}}, lp
+
+
+def get_owner_sweep(repos, pull_requests, reviews, latency, now):
+    """Return the launchpad sources and launchpad of the owner-sweep
+    scenario: repos owners each owning pull_requests branches, each the
+    target of a merge proposal from a branch of another person."""
+    lp = FakeLaunchpad(FakeAPI('launchpad', latency))
+    owners = {}
+    for i in range(repos):
+        owner = 'team{}'.format(i)
+        for number in range(pull_requests):
+            target_path = '~{}/project{}/trunk'.format(owner, number)
+            target = lp.add_branch(target_path, 'lp:' + target_path, owner)
+            source = lp.add_branch('~dev{}/project{}/feature'.format(
+                i, number), 'source')
+            mp = FakeMergeProposal(lp.api, target, source.self_link,
+                                   i * pull_requests + number, reviews,
+                                   now - datetime.timedelta(hours=number),
+                                   git=False)
+            target.merge_proposals.append(mp)
+            lp.add_merge_proposal(mp)
+        owners[owner] = {'max-age': 30}
+    return {'launchpad': {'branches': {}, 'owners': owners}}, lp
+
+
+class BenchmarkSessions(api_sessions.Sessions):
+    """Sessions whose clients are the fake providers of a scenario."""
+
+    def __init__(self, github=None, launchpad=None, concurrency=1):
+        super(BenchmarkSessions, self).__init__(
+            github_token='benchmark', github_concurrency=concurrency,
+            github_cache_size=0, launchpad_concurrency=concurrency,
+            launchpad_cache_size=0)
+        self.fake_github = github
+        self.fake_launchpad = launchpad
+
+    def github(self):
+        return self.fake_github
+
+    def launchpad(self):
+        return self.fake_launchpad
+
+
+def get_scenario(scenario, repos, pull_requests, reviews, latency):
+    """Return the sources and BenchmarkSessions of a scenario."""
+    now = pytz.utc.localize(datetime.datetime.utcnow())
+    if scenario == 'github':
+        gh = FakeGithub(repos, pull_requests, reviews, latency, now)
+        return {'github': gh.sources}, gh, None
+    if scenario == 'lp-git':
+        sources, lp = get_lp_git(repos, pull_requests, reviews, latency, now)
+    elif scenario == 'launchpad-branches':
+        sources, lp = get_launchpad_branches(repos, pull_requests, reviews,
+                                             latency, now)
+    else:
+        sources, lp = get_owner_sweep(repos, pull_requests, reviews, latency,
+                                      now)
+    return sources, None, FakeLaunchpadSessions(lp)
+
+
+def get_output_size(output_directory):
+    """Return the size of the report files, without the vendored assets."""
+    return sum(os.path.getsize(os.path.join(output_directory, name))
+               for name in ('reviews.html', 'reviews.json'))
+
+
+def run_once(scenario, repos, pull_requests, reviews, latency, concurrency,
+             trace_memory=False):
+    """Run aggregate_reviews once on freshly generated data and return its
+    measurements."""
+    sources, gh, lp_sessions = get_scenario(scenario, repos, pull_requests,
+                                            reviews, latency)
+    sessions = BenchmarkSessions(gh, lp_sessions, concurrency)
+    work_directory = tempfile.mkdtemp(prefix='review-gator-benchmark-')
+    output_directory = os.path.join(work_directory, 'output')
+    snap_user_common = os.environ.get('SNAP_USER_COMMON')
+    # Keep the caches and snapshots of the run out of the real ones
+    os.environ['SNAP_USER_COMMON'] = work_directory
+    # Rows rendered by an earlier run are not reused
+    rendering._renderers.clear()
+    review_gator.update_now()
+    instrumentation.end_cycle()
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            review_gator.aggregate_reviews(sources, output_directory,
+                                           sessions, False)
+            elapsed = time.perf_counter() - start
+            peak_memory = None
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        stats = instrumentation.end_cycle()
+        return {
+            'aggregate_time': elapsed,
+            'get_repo_data_time': stats.phases.get('get_repo_data', 0.0),
+            'render_time': stats.phases.get('render', 0.0),
+            'api_calls': sum(call_stats.count
+                             for resources in stats.calls.values()
+                             for call_stats in resources.values()),
+            'peak_memory': peak_memory,
+            'output_size': get_output_size(output_directory),
+        }
+    finally:
+        if snap_user_common is None:
+            os.environ.pop('SNAP_USER_COMMON', None)
+        else:
+            os.environ['SNAP_USER_COMMON'] = snap_user_common
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def measure_model_memory(scenario, repos, pull_requests, reviews,
+                         concurrency):
+    """Return the memory held by the repos collected for a scenario, along
+    with whatever they keep alive, once the fake providers are dropped."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        sources, gh, lp_sessions = get_scenario(scenario, repos,
+                                                pull_requests, reviews, 0)
+        sessions = BenchmarkSessions(gh, lp_sessions, concurrency)
+        snap_user_common = os.environ.get('SNAP_USER_COMMON')
+        work_directory = tempfile.mkdtemp(prefix='review-gator-benchmark-')
+        os.environ['SNAP_USER_COMMON'] = work_directory
+        try:
+            with open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                collected = review_gator.collect_repos(sources, sessions)
+        finally:
+            if snap_user_common is None:
+                os.environ.pop('SNAP_USER_COMMON', None)
+            else:
+                os.environ['SNAP_USER_COMMON'] = snap_user_common
+            shutil.rmtree(work_directory, ignore_errors=True)
+        del sources, gh, lp_sessions, sessions
+        instrumentation.end_cycle()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        del collected
+        gc.collect()
+        return size - tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(scenario, repos, pull_requests, reviews, latency,
+                 concurrency, repeat):
+    """Return the best timings of repeat runs of a scenario, along with the
+    peak memory of a further run under tracemalloc and the memory held by
+    the collected repos."""
+    runs = [run_once(scenario, repos, pull_requests, reviews, latency,
+                     concurrency) for _ in range(repeat)]
+    result = dict((name, min(run[name] for run in runs))
+                  for name in ('aggregate_time', 'get_repo_data_time',
+                               'render_time'))
+    result['api_calls'] = runs[-1]['api_calls']
+    result['output_size'] = runs[-1]['output_size']
+    result['peak_memory'] = run_once(
+        scenario, repos, pull_requests, reviews, latency, concurrency,
+        trace_memory=True)['peak_memory']
+    result['model_memory'] = measure_model_memory(
+        scenario, repos, pull_requests, reviews, concurrency)
+    return result
+
+
+def format_measurement(name, value):
+    if name.endswith('_time'):
+        return '{:.3f}s'.format(value)
+    if name in ('peak_memory', 'model_memory', 'output_size'):
+        return '{:.1f}KB'.format(value / 1024.0)
+    return str(value)
+
+
+def compare(results, baseline, tolerance):
+    """Print each result against the baseline and return the names of the
+    measurements more than tolerance percent above it."""
+    regressions = []
+    for key, result in results.items():
+        print(key)
+        base = baseline.get(key)
+        for name in MEASUREMENTS:
+            line = '  {:<20} {:>12}'.format(
+                name, format_measurement(name, result[name]))
+            if base is not None and base.get(name):
+                change = (result[name] - base[name]) * 100.0 / base[name]
+                line += '  baseline {:>12} {:+7.1f}%'.format(
+                    format_measurement(name, base[name]), change)
+                if change > tolerance:
+                    line += '  REGRESSION'
+                    regressions.append('{} {}'.format(key, name))
+            print(line)
+        if base is None:
+            print('  (no baseline)')
+    return regressions
+
+
+@click.command()
+@click.option('--scenario', 'scenarios', type=click.Choice(SCENARIOS),
+              multiple=True,
+              help="Scenario to run, may be given several times "
+                   "[default: all of them]")
+@click.option('--repos', type=click.IntRange(min=1), default=20,
+              help="Repositories, branches or owners of each scenario "
+                   "[default: 20]")
+@click.option('--pull-requests', type=click.IntRange(min=0), default=10,
+              help="Pull requests or merge proposals of each repository, "
+                   "branch or owner [default: 10]")
+@click.option('--reviews', type=click.IntRange(min=0), default=3,
+              help="Reviews, and comments, of each pull request "
+                   "[default: 3]")
+@click.option('--latency', type=click.FloatRange(min=0), default=0,
+              help="Milliseconds each fake API call takes [default: 0]")
+@click.option('--concurrency', type=click.IntRange(min=1), default=4,
+              help="Github and launchpad concurrency [default: 4]")
+@click.option('--repeat', type=click.IntRange(min=1), default=3,
+              help="Timed runs of each scenario, the best being kept "
+                   "[default: 3]")
+@click.option('--baseline', type=click.Path(dir_okay=False),
+              default=DEFAULT_BASELINE,
+              help="Results to compare with [default: {}]".format(
+                  DEFAULT_BASELINE))
+@click.option('--save-baseline', is_flag=True, default=False,
+              help='Store the results in the baseline file.')
+@click.option('--tolerance', type=click.FloatRange(min=0), default=20,
+              help="Percentage above the baseline reported as a "
+                   "regression [default: 20]")
+def main(scenarios, repos, pull_requests, reviews, latency, concurrency,
+         repeat, baseline, save_baseline, tolerance):
+    """Benchmark review-gator on generated data, without network access.
+
+    Exits with status 1 if a measurement regressed beyond the tolerance."""
+    try:
+        with open(baseline) as f:
+            stored = json.load(f)
+        if stored.get('version') != BASELINE_VERSION:
+            stored = {}
+    except (IOError, ValueError):
+        stored = {}
+    stored_results = stored.get('results', {})
+    results = collections.OrderedDict()
+    for scenario in scenarios or SCENARIOS:
+        # Results are only comparable for the same parameters
+        key = '{} repos={} pull_requests={} reviews={} latency={}ms ' \
+              'concurrency={}'.format(scenario, repos, pull_requests,
+                                      reviews, latency, concurrency)
+        results[key] = run_scenario(scenario, repos, pull_requests, reviews,
+                                    latency / 1000.0, concurrency, repeat)
+    regressions = compare(results, stored_results, tolerance)
+    if save_baseline:
+        stored_results.update(results)
+        with open(baseline, 'w') as f:
+            json.dump({'version': BASELINE_VERSION,
+                       'results': stored_results}, f, indent=2,
+                      sort_keys=True)
+        print("**** {} written ****".format(baseline))
+    if regressions and not save_baseline:
+        print("*** Regressions: {} ***".format(', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+A local cache of bare git mirrors of the repositories tox runs on.
+
+Each source repository is mirrored once, and only the branches tox runs on
+are fetched into it, so that later runs only fetch the new commits. Each
+tox run then gets a worktree of the mirror, checked out at the commit under
+test, instead of a fresh clone.
+
+Mirrors are shared with the tox jobs of other processes and guarded by a
+lock file each, held exclusively while the mirror is updated or a worktree
+is added or removed. While a worktree is in use its job holds a shared lock
+on a separate in-use marker file, which only eviction waits for, so that a
+long tox run does not hold back fetches into the same mirror. Mirrors
+unused for max_age seconds, then the least recently used ones above
+max_size bytes, are evicted unless in use.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import git
+
+# Seconds a mirror is kept after its last use
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+# Cap on the total size of the mirrors
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+
+def get_size(path):
+    """Return the total size of the files under path."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class GitMirrorCache(object):
+    """Bare mirrors of source repositories, each in a sub-directory of
+    directory named by the hash of the repository url."""
+
+    def __init__(self, directory, max_age=DEFAULT_MAX_AGE,
+                 max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+
+    def _path(self, source_repo):
+        return os.path.join(self.directory, '{}.git'.format(
+            hashlib.sha1(source_repo.encode('utf-8')).hexdigest()))
+
+    @contextlib.contextmanager
+    def _lock(self, source_repo):
+        """Hold the exclusive lock of the mirror of source_repo and mark the
+        mirror as used."""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = self._path(source_repo) + '.lock'
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                os.utime(lock_path)
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, source_repo, source_branch):
+        """Update the branch of the mirror of source_repo and return its
+        head commit.
+
+        Raises git.exc.GitCommandError if the branch cannot be fetched."""
+        path = self._path(source_repo)
+        with self._lock(source_repo):
+            if not os.path.isdir(path):
+                print("Mirroring repo {}".format(source_repo))
+                git.Repo.init(path, bare=True)
+            ref = 'refs/heads/{}'.format(source_branch)
+            mirror = git.Git(path)
+            mirror.fetch('--no-tags', '--force', source_repo,
+                         '+{}:{}'.format(ref, ref))
+            commit = mirror.rev_parse('--verify', ref + '^{commit}')
+        self.prune(keep=path)
+        return commit
+
+    @contextlib.contextmanager
+    def worktree(self, source_repo, commit):
+        """Yield the path of a temporary worktree of the mirror of
+        source_repo, checked out at commit."""
+        path = self._path(source_repo)
+        mirror = git.Git(path)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + '.inuse', 'a') as inuse_file, \
+                tempfile.TemporaryDirectory() as tmp_directory:
+            local_repo = os.path.join(tmp_directory, 'repo')
+            with self._lock(source_repo):
+                # Keeps the mirror from eviction until the worktree is
+                # removed, or the job is killed
+                fcntl.flock(inuse_file, fcntl.LOCK_SH)
+                # Forget the worktrees whose directories are gone
+                mirror.worktree('prune')
+                mirror.worktree('add', '--detach', local_repo, commit)
+            try:
+                yield local_repo
+            finally:
+                with self._lock(source_repo):
+                    mirror.worktree('remove', '--force', local_repo)
+                fcntl.flock(inuse_file, fcntl.LOCK_UN)
+
+    def prune(self, keep=None):
+        """Remove the mirrors unused for max_age seconds, then the least
+        recently used ones above max_size bytes, skipping those in use and
+        the mirror at path keep."""
+        mirrors = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.git'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                used = os.path.getmtime(path + '.lock')
+            except OSError:
+                used = 0
+            mirrors.append((used, path))
+        mirrors.sort(reverse=True)
+        expired = time.time() - self.max_age
+        total_size = 0
+        for used, path in mirrors:
+            size = get_size(path)
+            if path == keep or (used >= expired and
+                                total_size + size <= self.max_size):
+                total_size += size
+                continue
+            with open(path + '.lock', 'a') as lock_file, \
+                    open(path + '.inuse', 'a') as inuse_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(inuse_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # In use by another tox job
+                    total_size += size
+                    continue
+                try:
+                    print("Evicting the mirror {}".format(path))
+                    shutil.rmtree(path, ignore_errors=True)
+                finally:
+                    fcntl.flock(inuse_file, fcntl.LOCK_UN)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
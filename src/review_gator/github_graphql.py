@@ -0,0 +1,222 @@
+"""
+Collect github pull requests and reviews with batched GraphQL queries.
+
+The REST collector needs a list call per repository and three more calls per
+pull request. Here the open pull requests of several repositories, their
+reviews and the date of their newest comments are fetched together, one
+page of pull requests per repository per query. The rare pull requests with
+more than a page of reviews get a query per further page.
+"""
+
+import contextlib
+import datetime
+import time
+
+import pytz
+import requests
+
+from . import instrumentation
+from .review_gator import GithubPullRequest, GithubRepo, GithubReview
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+# Number of repositories queried together in the first query of a batch
+REPO_BATCH_SIZE = 10
+# Pull requests per page; kept small as each one embeds its reviews
+PULL_REQUEST_PAGE_SIZE = 25
+REVIEW_PAGE_SIZE = 50
+
+REVIEW_FRAGMENT = '''
+fragment reviewPage on PullRequestReviewConnection {
+  pageInfo { hasNextPage endCursor }
+  nodes {
+    url
+    state
+    submittedAt
+    author { login }
+    comments(last: 1) { nodes { createdAt } }
+  }
+}
+'''
+
+# Reviews are listed oldest first, as by the REST API
+REVIEWS = '''reviews(first: %d, after: %%s,
+            states: [APPROVED, CHANGES_REQUESTED, COMMENTED, DISMISSED]) {
+      ...reviewPage
+    }''' % REVIEW_PAGE_SIZE
+
+FRAGMENTS = '''
+fragment pullRequestPage on PullRequestConnection {
+  pageInfo { hasNextPage endCursor }
+  nodes {
+    id
+    url
+    title
+    state
+    createdAt
+    author { login }
+    comments(last: 1) { nodes { createdAt } }
+    %s
+  }
+}
+''' % (REVIEWS % 'null') + REVIEW_FRAGMENT
+
+PULL_REQUESTS = '''pullRequests(states: OPEN, first: %d, after: %%s,
+                 orderBy: {field: CREATED_AT, direction: DESC}) {
+      ...pullRequestPage
+    }''' % PULL_REQUEST_PAGE_SIZE
+
+REPOSITORY_PAGE_QUERY = '''
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    %s
+  }
+}
+''' % (PULL_REQUESTS % '$cursor') + FRAGMENTS
+
+REVIEW_PAGE_QUERY = '''
+query($id: ID!, $cursor: String) {
+  node(id: $id) {
+    ... on PullRequest {
+      %s
+    }
+  }
+}
+''' % (REVIEWS % '$cursor') + REVIEW_FRAGMENT
+
+
+class GraphQLError(Exception):
+    """The GraphQL endpoint reported errors for a query."""
+
+
+class GraphQLClient(object):
+    """A minimal client for the github GraphQL API."""
+
+    def __init__(self, token, url=GRAPHQL_URL, slots=None):
+        self.url = url
+        self.slots = slots
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'bearer {}'.format(token)
+        self.query_count = 0
+
+    def query(self, query, variables=None):
+        """Run a query and return its data, raising GraphQLError on errors."""
+        self.query_count += 1
+        variables = variables or {}
+        slot = contextlib.nullcontext()
+        if self.slots is not None:
+            slot = self.slots.slot()
+        with slot:
+            start = time.perf_counter()
+            response = self.session.post(
+                self.url, json={'query': query, 'variables': variables})
+        resource = instrumentation.NO_RESOURCE
+        if 'owner' in variables and 'name' in variables:
+            resource = '{}/{}'.format(variables['owner'], variables['name'])
+        instrumentation.get_stats().record_call(
+            'github-graphql', resource, time.perf_counter() - start)
+        response.raise_for_status()
+        result = response.json()
+        if result.get('errors'):
+            raise GraphQLError('; '.join(
+                error.get('message', str(error))
+                for error in result['errors']))
+        return result['data']
+
+
+def parse_date(value):
+    """Return a naive utc datetime for a GraphQL DateTime string."""
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_login(node):
+    """Return the author login of node; deleted users have no author."""
+    if node.get('author') is None:
+        return 'ghost'
+    return node['author']['login']
+
+
+def get_repositories_query(count):
+    """Return a query fetching the first pull request page of count repos."""
+    variables = ', '.join('$o{0}: String!, $n{0}: String!'.format(i)
+                          for i in range(count))
+    repositories = '\n'.join(
+        '  r{0}: repository(owner: $o{0}, name: $n{0}) {{\n'
+        '    url\n'
+        '    sshUrl\n'
+        '    {1}\n'
+        '  }}'.format(i, PULL_REQUESTS % 'null')
+        for i in range(count))
+    return 'query({}) {{\n{}\n}}\n'.format(variables, repositories) + \
+        FRAGMENTS
+
+
+def get_all_repos(client, sources, batch_size=REPO_BATCH_SIZE):
+    """Return all repos, prs and reviews for the given github sources."""
+    names = [(org.replace(' ', ''), name, sources[org][name]['review-count'])
+             for org in sources for name in sources[org]]
+    repos = []
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        variables = {}
+        for i, (owner, name, _) in enumerate(batch):
+            variables['o{}'.format(i)] = owner
+            variables['n{}'.format(i)] = name
+        data = client.query(get_repositories_query(len(batch)), variables)
+        for i, (owner, name, review_count) in enumerate(batch):
+            node = data['r{}'.format(i)]
+            gr = GithubRepo(node['url'], node['sshUrl'])
+            page = node['pullRequests']
+            add_prs(client, gr, page['nodes'], review_count)
+            while page['pageInfo']['hasNextPage']:
+                page = client.query(REPOSITORY_PAGE_QUERY, {
+                    'owner': owner,
+                    'name': name,
+                    'cursor': page['pageInfo']['endCursor'],
+                })['repository']['pullRequests']
+                add_prs(client, gr, page['nodes'], review_count)
+            if gr.pull_request_count > 0:
+                repos.append(gr)
+            print(gr)
+    return repos
+
+
+def get_review_nodes(client, node):
+    """Return the review nodes of a pull request node, querying the pages
+    of reviews after the first one."""
+    page = node['reviews']
+    review_nodes = list(page['nodes'])
+    while page['pageInfo']['hasNextPage']:
+        page = client.query(REVIEW_PAGE_QUERY, {
+            'id': node['id'],
+            'cursor': page['pageInfo']['endCursor'],
+        })['node']['reviews']
+        review_nodes.extend(page['nodes'])
+    return review_nodes
+
+
+def add_prs(client, gr, nodes, review_count):
+    """Add a pull request, with its reviews and activity, for each node."""
+    for node in nodes:
+        pr = GithubPullRequest(node['url'], node['title'], get_login(node),
+                               node['state'].lower(),
+                               parse_date(node['createdAt']), review_count)
+        gr.add(pr)
+        latest_activity = pr.date
+        comment_dates = [comment['createdAt']
+                         for comment in node['comments']['nodes']]
+        for review_node in get_review_nodes(client, node):
+            review = GithubReview(review_node['url'], get_login(review_node),
+                                  review_node['state'],
+                                  parse_date(review_node['submittedAt']))
+            pr.add_review(review)
+            # Review might be more recent than a comment
+            latest_activity = max(latest_activity, review.date)
+            comment_dates.extend(
+                comment['createdAt']
+                for comment in review_node['comments']['nodes'])
+        for comment_date in comment_dates:
+            latest_activity = max(latest_activity,
+                                  pytz.utc.localize(parse_date(comment_date)))
+        pr.latest_activity = latest_activity
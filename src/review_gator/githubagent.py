@@ -0,0 +1,98 @@
+import contextlib
+import functools
+import threading
+import time
+
+import github
+from github.GithubRetry import GithubRetry
+from github.Requester import HTTPSRequestsConnectionClass, RequestsResponse
+
+from . import instrumentation
+from .http_cache import CachedResponse
+
+# Seconds a request may wait for the github rate limit to reset; the rate
+# limit scheduler falls back to cached data rather than stalling the run
+MAX_RATE_LIMIT_WAIT = 0
+
+
+class ThreadSafeHTTPSConnection(HTTPSRequestsConnectionClass):
+    """An HTTPS connection that can be shared by several threads.
+
+    PyGithub keeps a single persistent connection per client and stores the
+    pending request on it between request() and getresponse(). This class
+    keeps the pending request per thread instead so that worker threads can
+    share the client and its pool of keep-alive connections.
+
+    When a cache is given, GET requests are made conditional on the cached
+    response and a 304 Not Modified answer is replaced by the cached body.
+
+    Each request is recorded in the instrumentation stats of the cycle and,
+    when slots are given, holds one of the sessions.RequestSlots.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.cache = kwargs.pop('cache', None)
+        self.slots = kwargs.pop('slots', None)
+        super(ThreadSafeHTTPSConnection, self).__init__(*args, **kwargs)
+        self._pending = threading.local()
+
+    def request(self, verb, url, input, headers, stream=False):
+        self._pending.request = (verb, url, input, headers, stream)
+
+    def getresponse(self):
+        verb, url, input, headers, stream = self._pending.request
+        url = '{}://{}:{}{}'.format(self.protocol, self.host, self.port, url)
+        key = None
+        cached = None
+        if self.cache is not None and verb == 'GET' and not stream:
+            key = self.cache.key(url, headers)
+            cached = self.cache.get(key)
+            if cached is not None:
+                headers = dict(headers)
+                headers.update(self.cache.validators(cached[0]))
+        slot = contextlib.nullcontext()
+        if self.slots is not None:
+            slot = self.slots.slot()
+        with slot:
+            start = time.perf_counter()
+            r = self.session.request(
+                verb,
+                url,
+                headers=headers,
+                data=input,
+                timeout=self.timeout,
+                verify=self.verify,
+                stream=stream,
+                allow_redirects=False)
+        instrumentation.get_stats().record_call(
+            'github', instrumentation.get_github_resource(url),
+            time.perf_counter() - start,
+            cached=cached is not None and r.status_code == 304)
+        if cached is not None and r.status_code == 304:
+            self.cache.hit(key)
+            entry, body = cached
+            return CachedResponse(entry, body, r.headers)
+        if key is not None and r.status_code == 200:
+            self.cache.store(key, r.status_code, r.headers, r.text)
+        return RequestsResponse(r)
+
+
+def get_github(github_username=None, github_password=None, github_token=None,
+               pool_size=None, cache=None, slots=None):
+    """ return a github API client, or None when no credentials are
+    given. pool_size is the number of keep-alive connections kept for
+    threads sharing the client. In case cache is specified GET responses
+    are cached in and revalidated against that http_cache.ResponseCache.
+    In case slots is specified each request holds one of those
+    sessions.RequestSlots """
+    retry = GithubRetry(max_rate_limit_wait=MAX_RATE_LIMIT_WAIT)
+    if github_token:
+        gh = github.Github(github_token, pool_size=pool_size, retry=retry)
+    elif github_username and github_password:
+        gh = github.Github(github_username, github_password,
+                           pool_size=pool_size, retry=retry)
+    else:
+        return None
+    gh.requester._Requester__connectionClass = functools.partial(
+        ThreadSafeHTTPSConnection, cache=cache, slots=slots)
+    return gh
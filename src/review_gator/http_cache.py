@@ -0,0 +1,198 @@
+"""
+A persistent, size bounded cache of HTTP GET responses.
+
+Responses are stored with their ETag and Last-Modified validators so that a
+later request for the same resource can be made conditional. When the
+server answers 304 Not Modified the cached body is used instead.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+# Default cap on the total size of cached response bodies
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+INDEX_FILENAME = 'index.json'
+
+
+class CacheStats(object):
+    """Hit, miss and eviction counters for a cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{} hits, {} misses ({:.0%} hit rate), {} evictions'.format(
+            self.hits, self.misses, self.hit_rate, self.evictions)
+
+    def record(self, hit):
+        """Count a lookup that was, or was not, answered from the cache."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_evictions(self, count=1):
+        """Count entries evicted from the cache."""
+        with self._lock:
+            self.evictions += count
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / float(lookups)
+
+
+class CachedResponse(object):
+    """A cached response, mimicking the response objects of PyGithub.
+
+    Headers of the 304 response (e.g. rate limit headers) take precedence
+    over the cached ones."""
+
+    def __init__(self, entry, body, fresh_headers):
+        self.status = entry['status']
+        self.headers = dict(entry['headers'])
+        for name, value in fresh_headers.items():
+            if name.lower() not in ('content-length', 'content-encoding'):
+                self.headers[name] = value
+        self.body = body
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.body
+
+
+class ResponseCache(object):
+    """An on-disk cache of response bodies with least recently used eviction.
+
+    The index of cached entries, in least to most recently used order, is
+    kept in memory and written to disk by save(). Bodies left out of the
+    saved index, by a process that ended before saving it, are removed when
+    the cache is loaded so that they do not escape eviction."""
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self.size = 0
+        self._lock = threading.Lock()
+        self._index = collections.OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILENAME)) as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            entries = []
+        for key, entry in entries:
+            if os.path.exists(self._path(key)):
+                self._index[key] = entry
+                self.size += entry['size']
+        for name in os.listdir(self.directory):
+            if name == INDEX_FILENAME or name in self._index:
+                continue
+            # Cannot be revalidated without its index entry
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def key(url, headers):
+        """Return the cache key of a request.
+
+        Responses depend on the credentials and media type requested as
+        well as the url."""
+        parts = [url, headers.get('Accept', ''),
+                 headers.get('Authorization', '')]
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the (entry, body) cached for key, or None."""
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is None:
+            return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return entry, f.read()
+        except IOError:
+            return None
+
+    @staticmethod
+    def validators(entry):
+        """Return the conditional request headers for a cached entry."""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def hit(self, key):
+        """Record that the entry for key was reused."""
+        self.stats.record(True)
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+
+    def store(self, key, status, headers, body):
+        """Cache a response body if it can be validated later."""
+        self.stats.record(False)
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+        data = body.encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self.size -= old['size']
+            self._index[key] = {
+                'status': status,
+                'headers': dict(headers),
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': len(data),
+            }
+            self.size += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_size and self._index:
+            key, entry = self._index.popitem(last=False)
+            self.size -= entry['size']
+            self.stats.record_evictions()
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def save(self):
+        """Write the cache index to disk."""
+        with self._lock:
+            entries = list(self._index.items())
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, os.path.join(self.directory, INDEX_FILENAME))
@@ -0,0 +1,185 @@
+"""
+Measure where each collection cycle spends its time.
+
+The stats of the current cycle hold the wall time of each phase of the
+cycle, the number and latency of the API requests made to each provider,
+broken down by the repository or other resource they were about, and the
+hit rates of the caches. They are recorded from any thread and written as
+json next to the report at the end of the cycle. The tox runs and the
+reporters work in the background and are counted in the cycle they finish
+in.
+"""
+
+import collections
+import contextlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+STATS_VERSION = 1
+# Resources listed, slowest first, in the summary of a cycle
+SLOWEST_RESOURCES = 10
+# An API request not about a single resource
+NO_RESOURCE = '-'
+GITHUB_REPO_PATH = re.compile(r'^/repos/([^/]+/[^/]+)')
+
+_stats = None
+_stats_lock = threading.Lock()
+
+
+class CallStats(object):
+    """The number and latency of the API requests about a resource."""
+
+    def __init__(self):
+        self.count = 0
+        self.cached = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, seconds, cached=False):
+        self.count += 1
+        if cached:
+            self.cached += 1
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+
+    def add(self, other):
+        self.count += other.count
+        self.cached += other.cached
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'cached': self.cached,
+            'total_time': round(self.total_time, 3),
+            'mean_time': round(self.total_time / self.count, 3)
+            if self.count else 0.0,
+            'max_time': round(self.max_time, 3),
+        }
+
+
+class CycleStats(object):
+    """The phase timings, API requests and cache statistics of a cycle."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = collections.OrderedDict()
+        self.calls = collections.defaultdict(
+            lambda: collections.defaultdict(CallStats))
+        self.caches = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        """Add seconds to the wall time of a phase."""
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of the with statement as part of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def record_call(self, provider, resource, seconds, cached=False):
+        """Record an API request to provider about resource."""
+        with self._lock:
+            self.calls[provider][resource].record(seconds, cached)
+
+    def record_cache(self, name, stats):
+        """Record the http_cache.CacheStats of a cache."""
+        with self._lock:
+            self.caches[name] = {
+                'hits': stats.hits,
+                'misses': stats.misses,
+                'hit_rate': round(stats.hit_rate, 3),
+                'evictions': stats.evictions,
+            }
+
+    def to_dict(self):
+        """Return the stats as a json serializable dict."""
+        with self._lock:
+            api_calls = collections.OrderedDict()
+            slowest = []
+            for provider, resources in sorted(self.calls.items()):
+                total = CallStats()
+                for resource, call_stats in resources.items():
+                    total.add(call_stats)
+                    slowest.append((call_stats.total_time, provider,
+                                    resource, call_stats))
+                api_calls[provider] = total.to_dict()
+                api_calls[provider]['resources'] = collections.OrderedDict(
+                    (resource, call_stats.to_dict())
+                    for resource, call_stats in sorted(resources.items()))
+            slowest.sort(key=lambda item: item[0], reverse=True)
+            return collections.OrderedDict([
+                ('version', STATS_VERSION),
+                ('started', int(self.started)),
+                ('duration', round(time.time() - self.started, 3)),
+                ('phases', collections.OrderedDict(
+                    (name, round(seconds, 3))
+                    for name, seconds in self.phases.items())),
+                ('api_calls', api_calls),
+                ('slowest_resources', [
+                    dict(call_stats.to_dict(), provider=provider,
+                         resource=resource)
+                    for _, provider, resource, call_stats
+                    in slowest[:SLOWEST_RESOURCES]]),
+                ('caches', self.caches),
+            ])
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+def get_stats():
+    """Return the CycleStats of the current cycle."""
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = CycleStats()
+        return _stats
+
+
+def end_cycle():
+    """Start a new cycle and return the CycleStats of the one ending."""
+    global _stats
+    with _stats_lock:
+        stats = _stats or CycleStats()
+        _stats = CycleStats()
+        return stats
+
+
+def phase(name):
+    """Time the body of a with statement as part of a phase of the current
+    cycle."""
+    return get_stats().phase(name)
+
+
+def get_github_resource(url):
+    """Return the 'org/name' of the repository a github API url is about."""
+    match = GITHUB_REPO_PATH.match(urllib.parse.urlsplit(url).path)
+    if match is None:
+        return NO_RESOURCE
+    return match.group(1)
+
+
+def get_launchpad_resource(url):
+    """Return the branch, repository or other top level object a launchpad
+    API url is about, such as '~owner/project/+git/name'."""
+    parts = urllib.parse.urlsplit(url).path.strip('/').split('/')
+    # Leave out the API version
+    parts = parts[1:]
+    if not parts or not parts[0]:
+        return NO_RESOURCE
+    if parts[0].startswith('~'):
+        if len(parts) > 2 and parts[2] == '+git':
+            return '/'.join(parts[:4])
+        return '/'.join(parts[:3])
+    return parts[0]
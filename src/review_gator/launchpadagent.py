@@ -1,10 +1,17 @@
+import contextlib
 import os
+import queue
 import sys
+import threading
 import time
 from launchpadlib.credentials import RequestTokenAuthorizationEngine
 from lazr.restfulclient.errors import HTTPError
 from launchpadlib.launchpad import Launchpad
 from launchpadlib.credentials import UnencryptedFileCredentialStore
+from lazr.restfulclient._browser import MultipleRepresentationCache
+
+from . import instrumentation
+from .http_cache import CacheStats
 
 ACCESS_TOKEN_POLL_TIME = 1
 WAITING_FOR_USER = """Open this link:
@@ -74,3 +81,166 @@ def get_launchpad(launchpadlib_dir=None, lp_credentials_store=None):
                                 authorization_engine=authorization_engine,
                                 launchpadlib_dir=launchpadlib_dir,
                                 version=lp_version)
+
+
+class ResourceCache(MultipleRepresentationCache):
+    """A launchpadlib representation cache that records when each cached
+    representation was last used, so that the least recently used ones can
+    be evicted by prune_cache.
+
+    Representations are validated with their ETag by httplib2 before they
+    are reused.
+    """
+
+    def get(self, key):
+        value = super(ResourceCache, self).get(key)
+        if value is not None:
+            try:
+                os.utime(self._get_key_path(key))
+            except OSError:
+                pass
+        return value
+
+
+def use_resource_cache(lp, stats):
+    """Make a launchpad session use a ResourceCache for its representations
+    and count the GET requests answered from it in stats."""
+    connection = lp._browser._connection
+    connection.cache = ResourceCache(connection.cache._cache_dir)
+    http_request = connection.request
+
+    def request(uri, method='GET', *args, **kwargs):
+        response, content = http_request(uri, method, *args, **kwargs)
+        if method == 'GET':
+            stats.record(response.fromcache)
+        return response, content
+
+    connection.request = request
+    return connection.cache._cache_dir
+
+
+def record_requests(lp):
+    """Record each request of a launchpad session in the instrumentation
+    stats of the cycle."""
+    connection = lp._browser._connection
+    http_request = connection.request
+
+    def request(uri, method='GET', *args, **kwargs):
+        start = time.perf_counter()
+        response, content = http_request(uri, method, *args, **kwargs)
+        instrumentation.get_stats().record_call(
+            'launchpad', instrumentation.get_launchpad_resource(uri),
+            time.perf_counter() - start,
+            cached=getattr(response, 'fromcache', False))
+        return response, content
+
+    connection.request = request
+
+
+def limit_requests(lp, slots):
+    """Make each request of a launchpad session hold one of the
+    sessions.RequestSlots."""
+    connection = lp._browser._connection
+    http_request = connection.request
+
+    def request(uri, method='GET', *args, **kwargs):
+        with slots.slot():
+            return http_request(uri, method, *args, **kwargs)
+
+    connection.request = request
+
+
+def prune_cache(cache_dir, max_size):
+    """Remove the least recently used files of a cache directory until it
+    holds at most max_size bytes. Return the number of files removed."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.startswith(ResourceCache.TEMPFILE_PREFIX):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    total_size = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        removed += 1
+    return removed
+
+
+class LaunchpadSessions(object):
+    """A pool of logged in launchpad sessions shared by threads.
+
+    A launchpadlib session, and the objects loaded through it, must not be
+    used by several threads at once, so a thread leases a session with
+    session() for as long as it uses it. Leases are re-entrant within a
+    thread. Sessions are logged in with get_launchpad when no idle one is
+    left, and kept for later leases until reset() is called.
+
+    In case cache_size is specified the sessions share a ResourceCache
+    that prune() keeps under cache_size bytes; its hit rate is in stats.
+    In case slots is specified each request holds one of those
+    sessions.RequestSlots.
+    """
+
+    def __init__(self, launchpadlib_dir=None, lp_credentials_store=None,
+                 cache_size=None, slots=None):
+        self.launchpadlib_dir = launchpadlib_dir
+        self.lp_credentials_store = lp_credentials_store
+        self.cache_size = cache_size
+        self.slots = slots
+        self.cache_dir = None
+        self.stats = CacheStats()
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+
+    def _login(self):
+        lp = get_launchpad(launchpadlib_dir=self.launchpadlib_dir,
+                           lp_credentials_store=self.lp_credentials_store)
+        if self.cache_size:
+            self.cache_dir = use_resource_cache(lp, self.stats)
+        record_requests(lp)
+        if self.slots is not None:
+            limit_requests(lp, self.slots)
+        return lp
+
+    @contextlib.contextmanager
+    def session(self):
+        """Lease a session to the calling thread."""
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            try:
+                self._local.lp = self._idle.get_nowait()
+            except queue.Empty:
+                self._local.lp = self._login()
+        self._local.depth = depth + 1
+        try:
+            yield self._local.lp
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self._idle.put(self._local.lp)
+                self._local.lp = None
+
+    def reset(self):
+        """Forget the idle sessions so that new ones log in again."""
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+    def prune(self):
+        """Evict least recently used representations over the size cap."""
+        if self.cache_dir is not None:
+            self.stats.record_evictions(
+                prune_cache(self.cache_dir, self.cache_size))
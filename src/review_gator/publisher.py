@@ -0,0 +1,119 @@
+"""
+Publish the report and its assets to the output directory.
+
+Files are written to a temporary file next to their destination and then
+renamed over it, so that readers of the output directory, such as a web
+server, never see a missing or half written file. Vendored assets are
+published under names holding a hash of their content, so that they can be
+cached for good and are only copied when their content changes.
+"""
+
+import hashlib
+import os
+import tempfile
+
+VENDOR_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "vendor")
+# Hex digits of the content hash in published asset names
+HASH_LENGTH = 12
+# Mode of published files, readable by the web server
+FILE_MODE = 0o644
+
+_vendor_hashes = None
+
+
+def write_file(path, data):
+    """Atomically replace the file at path with data, str or bytes."""
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + name)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            f.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def copy_file(source, path):
+    """Atomically copy source to path, unless path already holds the same
+    content. Returns True if path was written."""
+    with open(source, 'rb') as f:
+        data = f.read()
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except IOError:
+        pass
+    write_file(path, data)
+    return True
+
+
+def file_hash(path):
+    """Return the content hash of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(name, digest):
+    """Return name with the content hash digest before its extension."""
+    stem, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(stem, digest, ext)
+
+
+def get_vendor_hashes():
+    """Return the content hash of each vendored file, by relative path."""
+    global _vendor_hashes
+    if _vendor_hashes is None:
+        hashes = {}
+        for root, _, files in os.walk(VENDOR_PATH):
+            for name in files:
+                path = os.path.join(root, name)
+                hashes[os.path.relpath(path, VENDOR_PATH)] = file_hash(path)
+        _vendor_hashes = hashes
+    return _vendor_hashes
+
+
+def get_vendor_urls():
+    """Return the url, relative to the report, of each vendored file by its
+    relative path.
+
+    Top level assets are published under hashed names. Files in
+    sub-directories, such as the fonts referenced by relative urls in the
+    stylesheet, keep their names."""
+    urls = {}
+    for relative_path, digest in get_vendor_hashes().items():
+        if os.path.dirname(relative_path):
+            name = relative_path
+        else:
+            name = hashed_name(relative_path, digest)
+        urls[relative_path] = 'vendor/{}'.format(name.replace(os.sep, '/'))
+    return urls
+
+
+def get_assets():
+    """Return the url of each top level vendored asset by name."""
+    return dict((relative_path, url)
+                for relative_path, url in get_vendor_urls().items()
+                if not os.path.dirname(relative_path))
+
+
+def publish_assets(output_directory):
+    """Publish the vendored assets to the vendor directory of the output
+    directory and return the url of each top level asset by name.
+
+    Hashed assets are only written when missing, the others only when their
+    content differs."""
+    for relative_path, url in sorted(get_vendor_urls().items()):
+        path = os.path.join(output_directory, *url.split('/'))
+        if os.path.dirname(relative_path) or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            copy_file(os.path.join(VENDOR_PATH, relative_path), path)
+    return get_assets()
@@ -0,0 +1,182 @@
+"""
+Share the github rate limit between the configured repositories.
+
+The requests needed to collect each repository are estimated from the
+snapshot of the previous run. Repositories are then planned in priority
+order - first those never collected, then the most recently active and
+those with the most pull requests - while the remaining rate limit allows.
+The others are restored from the snapshot rather than failing the run.
+One scheduler plans every collection of a rate limit window, including the
+repositories of the scheduler entries due together.
+"""
+
+import datetime
+import math
+import threading
+import time
+
+import github
+
+# Requests left untouched for other users of the same credentials
+RESERVE = 100
+# Pull requests per page of the REST list calls
+PAGE_SIZE = 30
+# Open pull requests assumed for a repo that has not been collected yet
+UNKNOWN_PULL_REQUESTS = 10
+# Calls fetching the reviews, comments and issue comments of a pull request
+ACTIVITY_REQUESTS = 3
+
+
+def estimate_requests(pull_request_count):
+    """Return the requests needed to collect a repo with the given number of
+    open pull requests."""
+    pages = max(1, int(math.ceil(pull_request_count / float(PAGE_SIZE))))
+    return 1 + pages + ACTIVITY_REQUESTS * pull_request_count
+
+
+class RateLimitScheduler(object):
+    """Plan and guard the github requests of one rate limit window.
+
+    The scheduler is shared by every collection made until the rate limit
+    resets. Once the remaining rate limit reaches the reserve, or a request
+    fails because the rate limit is exhausted, later calls through call()
+    return None without making a request until the reset time has passed."""
+
+    def __init__(self, gh, reserve=RESERVE):
+        self.gh = gh
+        self.reserve = reserve
+        self.planned = 0
+        # Repos, by key, restored from the snapshot or skipped the last time
+        # they were collected
+        self.cached = set()
+        self.skipped = set()
+        self.exhausted = False
+        # Estimated requests of the repos considered by plan_ahead, by key,
+        # None for those left out
+        self._ahead = {}
+        self._lock = threading.Lock()
+        self._start_window()
+
+    def __str__(self):
+        remaining, limit = self.gh.rate_limiting
+        summary = '{} of {} requests used, {} left until {} UTC'.format(
+            self.remaining - remaining, limit, remaining,
+            self.reset.strftime('%H:%M'))
+        if self.cached:
+            summary += ', {} repos from cache'.format(len(self.cached))
+        if self.skipped:
+            summary += ', {} repos skipped'.format(len(self.skipped))
+        return summary
+
+    def in_window(self, gh):
+        """True if the scheduler is for the github client gh and the rate
+        limit has not reset since the scheduler was created."""
+        return gh is self.gh and time.time() < self.resettime
+
+    def refresh(self):
+        """Update the rate limit from github before a collection, starting
+        a new window once the reset time has passed.
+
+        The rate limit of the client is otherwise only updated by the
+        requests it makes, which stop once the reserve is reached."""
+        with self._lock:
+            if time.time() >= self.resettime:
+                self._start_window()
+            else:
+                self._get_rate_limit()
+
+    def _start_window(self):
+        self._get_rate_limit()
+        self.remaining, self.limit = self.gh.rate_limiting
+        self.resettime = self.gh.rate_limiting_resettime
+        self.reset = datetime.datetime.utcfromtimestamp(self.resettime)
+        self.exhausted = False
+
+    def _get_rate_limit(self):
+        # Checking the rate limit does not count against it
+        try:
+            self.gh.get_rate_limit()
+        except github.GithubException as e:
+            print("*** Could not check the github rate limit: {} ***".format(
+                e))
+
+    @staticmethod
+    def priority(snapshot, key):
+        """Return the sort key of a repo, lowest first."""
+        if snapshot is None or key not in snapshot:
+            # Never collected, so there is nothing to fall back to
+            return (0, 0, 0)
+        updated_at = snapshot.updated_at(key)
+        activity = updated_at.timestamp() if updated_at else 0
+        return (1, -activity, -snapshot.pull_request_count(key))
+
+    def plan(self, keys, snapshot=None, incremental=False):
+        """Return the set of repo keys to fetch within the rate limit.
+
+        The repos planned ahead are fetched, and those left out by
+        plan_ahead are not. The others are taken in priority order while
+        their estimated requests fit in the remaining rate limit, less the
+        reserve and the requests planned ahead."""
+        with self._lock:
+            ahead = dict((key, self._ahead.pop(key)) for key in keys
+                         if key in self._ahead)
+            fetch = set(key for key, cost in ahead.items()
+                        if cost is not None)
+            fetch.update(self._plan(
+                [key for key in keys if key not in ahead], snapshot,
+                incremental))
+        return fetch
+
+    def plan_ahead(self, keys, snapshot=None, incremental=False):
+        """Plan the repos of several collections about to start together,
+        so that the rate limit goes to the repos of the highest priority
+        among all of them. The later plan() of each collection fetches the
+        repos planned here."""
+        with self._lock:
+            fetch = self._plan(keys, snapshot, incremental)
+            self._ahead.update((key, fetch.get(key)) for key in keys)
+
+    def _plan(self, keys, snapshot, incremental):
+        """Return the estimated requests, by key, of the repos fitting in
+        the rate limit."""
+        remaining, _ = self.gh.rate_limiting
+        budget = remaining - self.reserve - sum(
+            cost for cost in self._ahead.values() if cost is not None)
+        fetch = {}
+        for key in sorted(keys, key=lambda key: self.priority(snapshot, key)):
+            if snapshot is None or key not in snapshot:
+                cost = estimate_requests(UNKNOWN_PULL_REQUESTS)
+            elif incremental:
+                cost = estimate_requests(1)
+            else:
+                cost = estimate_requests(snapshot.pull_request_count(key))
+            if cost <= budget:
+                fetch[key] = cost
+                budget -= cost
+                self.planned += cost
+        return fetch
+
+    def call(self, func, *args, **kwargs):
+        """Return func(*args, **kwargs), or None if the rate limit is or
+        becomes exhausted."""
+        if time.time() >= self.resettime:
+            self.refresh()
+        if self.exhausted:
+            return None
+        remaining, _ = self.gh.rate_limiting
+        if remaining <= self.reserve:
+            self._exhaust("github rate limit down to its reserve of {} "
+                          "requests".format(self.reserve))
+            return None
+        try:
+            return func(*args, **kwargs)
+        except github.RateLimitExceededException:
+            self._exhaust("github rate limit exhausted")
+            return None
+
+    def _exhaust(self, reason):
+        with self._lock:
+            if not self.exhausted:
+                print("*** {}, using cached data for the remaining repos "
+                      "***".format(reason))
+            self.exhausted = True
@@ -0,0 +1,102 @@
+"""
+Render the review report from cached row fragments.
+
+The templates are compiled once per process. Each pull request row is
+rendered on its own and kept, keyed by a hash of the data it shows, so that
+a report only renders the rows that are new or have changed since the
+previous report before stitching the page together.
+"""
+
+import hashlib
+import json
+import os
+
+from jinja2 import Environment, FileSystemLoader
+
+from .http_cache import CacheStats
+
+TEMPLATES_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "templates")
+# Fields of the repo and pull request data shown in a row
+REPO_FIELDS = ('repo_name', 'repo_url', 'repo_shortname', 'tox')
+PULL_REQUEST_FIELDS = ('id', 'url', 'title', 'source', 'target', 'state',
+                       'owner', 'date', 'age', 'latest_activity',
+                       'latest_activity_age')
+REVIEW_FIELDS = ('owner', 'state', 'age')
+
+_renderers = {}
+
+
+def row_key(repo, pull_request, tox):
+    """Return the hash of the data shown in a pull request row."""
+    data = [tox,
+            [repo[field] for field in REPO_FIELDS],
+            [pull_request[field] for field in PULL_REQUEST_FIELDS],
+            [[review[field] for field in REVIEW_FIELDS]
+             for review in pull_request['reviews']]]
+    return hashlib.sha1(
+        json.dumps(data, default=str).encode('utf-8')).hexdigest()
+
+
+class ReportRenderer(object):
+    """Render report pages, reusing the rows rendered for the last page."""
+
+    def __init__(self, templates_path=TEMPLATES_PATH):
+        env = Environment(loader=FileSystemLoader(templates_path),
+                          auto_reload=False)
+        self.page_template = env.get_template('reviews.html')
+        self.row_template = env.get_template('pull_request_row.html')
+        self.client_template = env.get_template('reviews_client.html')
+        self.stats = CacheStats()
+        # Rows rendered, out of the rows, of the last page
+        self.rendered_count = 0
+        self.row_count = 0
+        self._rows = {}
+
+    def render_rows(self, repos, tox, partial=False):
+        """Return the html of the rows of every pull request in repos.
+
+        Only the rows used by this page are kept for the next one, unless
+        the page is a partial report and a later page will hold more
+        rows."""
+        rows = {}
+        html = []
+        self.rendered_count = 0
+        for repo in repos.values():
+            for pull_request in repo['pull_requests']:
+                key = row_key(repo, pull_request, tox)
+                row = rows.get(key) or self._rows.get(key)
+                self.stats.record(row is not None)
+                if row is None:
+                    self.rendered_count += 1
+                    row = self.row_template.render(
+                        repo=repo, pull_request=pull_request, tox=tox)
+                rows[key] = row
+                html.append(row)
+        if partial:
+            self._rows.update(rows)
+        else:
+            self._rows = rows
+        self.row_count = len(html)
+        return html
+
+    def render(self, repos, tox, **context):
+        """Return the html of a report page for the repos data.
+
+        A page with sections still pending is a partial report."""
+        rows = self.render_rows(repos, tox, bool(context.get('pending')))
+        return self.page_template.render(rows=rows, tox=tox, **context)
+
+    def render_client(self, tox, **context):
+        """Return the html of a report page that loads its rows from the
+        json report at context['data_url']."""
+        return self.client_template.render(tox=tox, **context)
+
+
+def get_renderer(name=None):
+    """Return the ReportRenderer of this process for the report called name,
+    each report keeping the rows of its own last page."""
+    renderer = _renderers.get(name)
+    if renderer is None:
+        renderer = _renderers[name] = ReportRenderer()
+    return renderer
@@ -1,13 +1,51 @@
+"""
+Report metrics of the review data to external services.
+
+Reporters run on a background thread of a ReporterDispatcher, so that a slow
+or unavailable service never holds up the report. Data waiting to be
+reported is kept in a bounded buffer, dropping the oldest data once full,
+and whatever has accumulated is handed to each reporter as one batch.
+Failed batches are retried with exponential backoff.
+"""
+
+import collections
 import datetime
+import math
 import os
+import threading
+import time
 
 import pytz
 
+from . import instrumentation
+
 try:
-    from typing import Dict, List, Text
+    from typing import Dict, List, Optional, Text, Tuple
 except ImportError:
     pass
 
+# Reports waiting to be sent, beyond which the oldest are dropped
+DEFAULT_MAX_PENDING = 10
+# Attempts at sending a batch after the first one fails
+DEFAULT_RETRIES = 4
+# Seconds before the first retry, doubling at each attempt
+DEFAULT_BACKOFF = 2
+# Seconds to wait for the queued reports to be sent before exiting
+DEFAULT_FLUSH_TIMEOUT = 60
+# Percentiles of the pull request ages reported
+AGE_PERCENTILES = (50, 90, 99)
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def percentile(values, percent):  # type: (List[float], float) -> float
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
 
 class ReviewGatorReporter(object):
     """Super-class that ReviewGator reporters should inherit from."""
@@ -16,6 +54,13 @@ class ReviewGatorReporter(object):
         """Perform reporting with the given data dict."""
         raise NotImplementedError
 
+    def process_batch(self, batch):  # type: (List[Tuple]) -> None
+        """Perform reporting with each (time, data dict, config name) of
+        batch, oldest first. The config name is None unless several configs
+        are reported."""
+        for _, data, _ in batch:
+            self.process_data(data)
+
     @classmethod
     def enabled(cls):  # type: () -> bool
         """A bool indicating whether this reporting class should be called."""
@@ -24,16 +69,28 @@ class ReviewGatorReporter(object):
 
 class InfluxDBTotalAgeReporter(ReviewGatorReporter):
     """
-    When enabled, report the sum of the ages of reviews to InfluxDB.
+    When enabled, report the ages and reviews of pull requests to InfluxDB.
 
     Will disable itself if either (a) the influxdb library isn't importable,
     or (b) the REVIEW_GATOR_METRIC_NAME environment variable isn't set.
 
     The REVIEW_GATOR_METRIC_NAME environment variable is used to determine the
-    metric name under which results will be submitted.
+    metric name under which results will be submitted. Each report writes, in
+    a single request for the whole batch:
+
+    * to the metric, the sum of the ages of all the pull requests, their
+      number and percentiles of their ages
+    * to the metric suffixed with _repo, the same for each repo, tagged with
+      the repo name
+    * to the metric suffixed with _reviews, the number of reviews in each
+      state of each repo, tagged with the repo name and review state
+
+    The points of a report of one of several configs are also tagged with
+    the name of the config.
 
-    The following environment variables will be used to configure the InfluxDB
-    client if present (falling back to the client's defaults otherwise):
+    Ages are in seconds. The following environment variables will be used to
+    configure the InfluxDB client if present (falling back to the client's
+    defaults otherwise):
 
     * INFLUXDB_HOST
     * INFLUXDB_PORT
@@ -43,9 +100,7 @@ class InfluxDBTotalAgeReporter(ReviewGatorReporter):
     """
 
     def __init__(self):  # type: () -> None
-        self.now = pytz.utc.localize(datetime.datetime.utcnow())
-
-        from influxdb import InfluxDBClient, SeriesHelper
+        from influxdb import InfluxDBClient
         # Construct tuples for dict creation
         influxdb_args = ['host', 'port', 'username', 'password', 'database']
         client_tuples = [(k, os.environ.get('INFLUXDB_{}'.format(k.upper())))
@@ -54,35 +109,76 @@ class InfluxDBTotalAgeReporter(ReviewGatorReporter):
         # are used
         client_kwargs = {k: v for k,v in client_tuples if v is not None}
         self.client = InfluxDBClient(**client_kwargs)
+        self.metric_name = os.environ['REVIEW_GATOR_METRIC_NAME']
 
-        # Define this class here, where we know that influxdb is importable
-        class ReviewAgeSeries(SeriesHelper):
-
-            class Meta(object):
-                series_name = os.environ['REVIEW_GATOR_METRIC_NAME']
-                fields = ['total_age']
-                tags = []  # type: List[Text]
-
-        self.series_cls = ReviewAgeSeries
+    @staticmethod
+    def _get_age_fields(ages):  # type: (List[float]) -> Dict
+        """Given the ages of some pull requests, return their fields."""
+        ages = sorted(ages)
+        fields = {
+            'total_age': float(sum(ages)),
+            'pull_requests': len(ages),
+            'age_max': float(ages[-1]) if ages else 0.0,
+        }
+        for percent in AGE_PERCENTILES:
+            fields['age_p{}'.format(percent)] = float(
+                percentile(ages, percent))
+        return fields
 
-    def _determine_total_age_in_seconds(self, data):  # type: (Dict) -> float
-        """Given a review-gator data dict, sum up the review ages."""
-        total_age = 0
-        for repo in data.values():
-            for pr in repo['pull_requests']:
-                total_age += (self.now - pr['date']).total_seconds()
-        return total_age
+    def _get_points(self,
+                    now,  # type: datetime.datetime
+                    data,  # type: Dict
+                    config_name=None,  # type: Optional[Text]
+                    ):
+        # type: (...) -> List[Dict]
+        """Given a review-gator data dict, return its InfluxDB points."""
+        timestamp = int((now - datetime.datetime(
+            1970, 1, 1, tzinfo=pytz.utc)).total_seconds())
+        config_tags = {} if config_name is None else {'config': config_name}
+        points = []
+        all_ages = []
+        for repo_name, repo in sorted(data.items()):
+            ages = [(now - pr['date']).total_seconds()
+                    for pr in repo['pull_requests']]
+            all_ages.extend(ages)
+            points.append({
+                'measurement': '{}_repo'.format(self.metric_name),
+                'tags': dict(config_tags, repo=repo_name),
+                'time': timestamp,
+                'fields': self._get_age_fields(ages),
+            })
+            review_counts = collections.Counter(
+                review['state'] for pr in repo['pull_requests']
+                for review in pr['reviews'])
+            for state, count in sorted(review_counts.items()):
+                points.append({
+                    'measurement': '{}_reviews'.format(self.metric_name),
+                    'tags': dict(config_tags, repo=repo_name, state=state),
+                    'time': timestamp,
+                    'fields': {'count': count},
+                })
+        points.append({
+            'measurement': self.metric_name,
+            'tags': config_tags,
+            'time': timestamp,
+            'fields': self._get_age_fields(all_ages),
+        })
+        return points
 
-    def _record_event_in_influxdb(self, total_age):  # type: (float) -> None
-        """Given a total age, push that in to InfluxDB."""
-        self.series_cls(total_age=total_age)
-        self.series_cls.commit(self.client)
-        print(total_age)
+    def process_batch(self, batch):  # type: (List[Tuple]) -> None
+        """Push the points of every report of the batch to InfluxDB in a
+        single write."""
+        points = []
+        for now, data, config_name in batch:
+            points.extend(self._get_points(now, data, config_name))
+        self.client.write_points(points, time_precision='s')
+        print("Reported {} points of {} reports to InfluxDB".format(
+            len(points), len(batch)))
 
     def process_data(self, data):  # type: (Dict) -> None
-        """Determine the total age of reviews and push to InfluxDB."""
-        total_age = self._determine_total_age_in_seconds(data)
-        self._record_event_in_influxdb(total_age)
+        """Push the metrics of the data to InfluxDB."""
+        self.process_batch(
+            [(pytz.utc.localize(datetime.datetime.utcnow()), data, None)])
 
     @classmethod
     def enabled(cls):  # type: () -> bool
@@ -94,4 +190,109 @@ class InfluxDBTotalAgeReporter(ReviewGatorReporter):
         return 'REVIEW_GATOR_METRIC_NAME' in os.environ
 
 
+class ReporterDispatcher(object):
+    """Hand the data of each report to reporters from a background thread.
+
+    Up to max_pending reports wait to be sent; the oldest is dropped when a
+    newer one arrives and the buffer is full. The reports waiting when a
+    reporter becomes free are sent to it as one batch. A failed batch is
+    retried up to retries times, waiting backoff seconds before the first
+    retry and twice as long before each of the next, then dropped."""
+
+    def __init__(self, reporters, max_pending=DEFAULT_MAX_PENDING,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.reporters = reporters
+        self.retries = retries
+        self.backoff = backoff
+        self.dropped = 0
+        self._pending = collections.deque(maxlen=max_pending)
+        self._busy = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._work,
+                                        name='review-gator-reporters')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self,
+               data,  # type: Dict
+               now=None,  # type: Optional[datetime.datetime]
+               config_name=None,  # type: Optional[Text]
+               ):
+        # type: (...) -> None
+        """Queue the data of a report generated at now, of the named config
+        if given, without waiting for it to be sent."""
+        if now is None:
+            now = pytz.utc.localize(datetime.datetime.utcnow())
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+                print("*** Reporters are falling behind, dropped the "
+                      "oldest report ***")
+            self._pending.append((now, data, config_name))
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):  # type: (Optional[float]) -> bool
+        """Wait up to timeout seconds for the queued reports to be sent.
+        Returns False if some are still waiting."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._busy, timeout)
+
+    def _work(self):  # type: () -> None
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                batch = list(self._pending)
+                self._pending.clear()
+                self._busy = True
+            try:
+                for reporter in self.reporters:
+                    self._send(reporter, batch)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _send(self,
+              reporter,  # type: ReviewGatorReporter
+              batch,  # type: List[Tuple]
+              ):
+        # type: (...) -> None
+        name = type(reporter).__name__
+        for attempt in range(self.retries + 1):
+            try:
+                with instrumentation.phase('reporters'):
+                    reporter.process_batch(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    print("*** {} failed, dropped {} reports: {} ***".format(
+                        name, len(batch), e))
+                    return
+                delay = self.backoff * 2 ** attempt
+                print("*** {} failed, retrying in {}s: {} ***".format(
+                    name, delay, e))
+                time.sleep(delay)
+
+
 REPORTER_CLASSES = [InfluxDBTotalAgeReporter]
+
+
+def get_dispatcher():  # type: () -> Optional[ReporterDispatcher]
+    """Return the ReporterDispatcher of the enabled reporters of this
+    process, or None if no reporter is enabled."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            reporters = [reporter_cls() for reporter_cls in REPORTER_CLASSES
+                         if reporter_cls.enabled()]
+            if not reporters:
+                return None
+            _dispatcher = ReporterDispatcher(reporters)
+        return _dispatcher
+
+
+def flush(timeout=DEFAULT_FLUSH_TIMEOUT):  # type: (Optional[float]) -> None
+    """Wait up to timeout seconds for the queued reports to be sent."""
+    if _dispatcher is not None and not _dispatcher.flush(timeout):
+        print("*** Gave up waiting for the reporters ***")
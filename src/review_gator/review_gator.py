@@ -1,30 +1,52 @@
 #!/usr/bin/env python
 
+import collections
+import copy
 import datetime
+import functools
+import json
 import os
-import shutil
 import socket
 import sys
+import threading
 import time
 
 import click
-import github
 import humanize
 import pytz
 import yaml
 
 from babel.dates import format_datetime
-from jinja2 import Environment, FileSystemLoader
 from joblib import Parallel, delayed
 
 from lpshipit import _format_git_branch_name
 from pkg_resources import resource_filename
 
+from . import instrumentation
+from . import publisher
+from . import rendering
+from . import sessions as api_sessions
 from . import tox_runner
 from . import clicklib
-from .reporters import REPORTER_CLASSES
+from . import reporters
 
 MAX_DESCRIPTION_LENGTH = 80
+# Instrumentation stats of the last cycle, written next to the report
+STATS_FILENAME = 'reviews-stats.json'
+# cProfile dump of a --profile run, written next to the report
+PROFILE_FILENAME = 'reviews.prof'
+# Version of the format of reviews.json
+JSON_VERSION = 2
+PR_ACTIVITY_METHODS = ('get_reviews', 'get_comments', 'get_issue_comments')
+MP_STATUSES = ['Needs review', 'Work in progress']
+# Ages kept by get_age, enough for the rows and reviews of a report
+AGE_CACHE_SIZE = 8192
+# Config sections collected by review-gator, and the provider of each
+PROVIDER_SECTIONS = collections.OrderedDict([
+    ('lp-git', api_sessions.LAUNCHPAD),
+    ('launchpad', api_sessions.LAUNCHPAD),
+    ('github', api_sessions.GITHUB),
+])
 NOW = pytz.utc.localize(datetime.datetime.utcnow())
 
 
@@ -32,11 +54,16 @@ class Repo(object):
     '''Base class for a source code repository.
 
     These are the github repository or launchpad branch  that a pull request
-    will target. A repo contain 0 or more pull requests.'''
+    will target. A repo contain 0 or more pull requests.
 
-    def __init__(self, repo_type, handle, url, name):
+    The model holds only what the report is rendered from, and no reference
+    to the API objects it was built from, so that they are released as soon
+    as their data is extracted.'''
+    __slots__ = ('repo_type', 'url', 'name', 'pull_requests',
+                 'pull_requests_requiring_tox', 'tox')
+
+    def __init__(self, repo_type, url, name):
         self.repo_type = repo_type
-        self.handle = handle
         self.url = url
         self.name = name
         self.pull_requests = []
@@ -59,31 +86,44 @@ class Repo(object):
         '''Add a pull request to this repository.'''
         self.pull_requests.append(pull_request)
 
-    def add_requiring_tox(self, pull_request_requiring_tox):
-        '''Add a pull request that requires tox to this repository.'''
-        self.pull_requests_requiring_tox.append(pull_request_requiring_tox)
+    def add_requiring_tox(self, tox_job):
+        '''Add the tox_runner.ToxJob of a pull request that requires tox to
+        this repository.'''
+        self.pull_requests_requiring_tox.append(tox_job)
 
 
 class GithubRepo(Repo):
     '''A github repository.'''
-    def __init__(self, handle, url, name):
-        super(GithubRepo, self).__init__('github', handle, url, name)
+    __slots__ = ()
+
+    def __init__(self, url, name):
+        super(GithubRepo, self).__init__('github', url, name)
 
 
 class LaunchpadRepo(Repo):
     '''A launchpad repository (aka branch).'''
-    def __init__(self, handle, url, name):
-        super(LaunchpadRepo, self).__init__('launchpad', handle, url, name)
+    __slots__ = ()
+
+    def __init__(self, url, name):
+        super(LaunchpadRepo, self).__init__('launchpad', url, name)
 
 
 class PullRequest(object):
     '''Base class for a request to merge into a repository.
 
-    Represents a github pull request or launchpad merge proposal.'''
-    def __init__(self, pull_request_type, handle, url, title, owner, state,
+    Represents a github pull request or launchpad merge proposal. The
+    templates read its fields, as attributes or items, straight from the
+    model.'''
+    __slots__ = ('pull_request_type', 'url', 'title', 'owner', 'state',
+                 'latest_activity', 'date', 'review_count', 'reviews')
+    # The branches of a launchpad merge proposal, shown before its plain
+    # text title; github pull requests have none
+    source = None
+    target = None
+
+    def __init__(self, pull_request_type, url, title, owner, state,
                  date, review_count, latest_activity=None):
         self.pull_request_type = pull_request_type
-        self.handle = handle
         self.url = url
         self.title = title
         self.owner = owner
@@ -98,6 +138,12 @@ class PullRequest(object):
             self.pull_request_type, self.title, self.owner, self.state,
             self.date)
 
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
     @property
     def age(self):
         # print(u'{}'.format(self))
@@ -114,40 +160,54 @@ class PullRequest(object):
     def mp_id(self):
         return self.url.split('/')[-1]
 
+    @property
+    def id(self):
+        return self.mp_id
+
     def add_review(self, review):
         '''Adds a review, replacing any older review by the same owner.'''
         for idx, r in enumerate(self.reviews):
-            if review.owner == r['owner'] and review.date > r['date']:
+            if review.owner == r.owner and review.date > r.date:
                 del self.reviews[idx]
                 break
-        self.reviews.append(merge_two_dicts(review.__dict__,
-                                            {'age': review.age}))
+        self.reviews.append(review)
 
 
 class GithubPullRequest(PullRequest):
     '''A github pull request.'''
-    def __init__(self, handle, url, title, owner, state, date, review_count,
+    __slots__ = ()
+
+    def __init__(self, url, title, owner, state, date, review_count,
                  latest_activity=None):
-        date = pytz.utc.localize(date)
+        date = to_utc(date)
         super(GithubPullRequest, self).__init__(
-                'github', handle, url, title, owner, state, date, review_count,
+                'github', url, title, owner, state, date, review_count,
                 latest_activity=latest_activity)
 
 
 class LaunchpadPullRequest(PullRequest):
-    '''A launchpad pull request (aka merte proposal).'''
-    def __init__(self, handle, url, title, owner, state, date, review_count,
-                 latest_activity=None):
+    '''A launchpad pull request (aka merte proposal).
+
+    tox_job holds the tox_runner.ToxJob of a merge proposal requiring tox,
+    extracted while the merge proposal is loaded.'''
+    __slots__ = ('source', 'target', 'tox_job')
+
+    def __init__(self, url, title, owner, state, date, review_count,
+                 latest_activity=None, source=None, target=None):
         super(LaunchpadPullRequest, self).__init__(
-                'launchpad', handle, url, title, owner, state, date,
+                'launchpad', url, title, owner, state, date,
                 review_count, latest_activity=latest_activity)
+        self.source = source
+        self.target = target
+        self.tox_job = None
 
 
 class Review(object):
     '''A completed or requested review attached to a pull request.'''
-    def __init__(self, review_type, review, url, owner, state, date):
+    __slots__ = ('review_type', 'url', 'owner', 'state', 'date')
+
+    def __init__(self, review_type, url, owner, state, date):
         self.review_type = review_type
-        self.review = review
         self.url = url
         self.owner = owner
         self.state = state
@@ -155,7 +215,13 @@ class Review(object):
 
     def __repr__(self):
         return u'Review[{}, {}, {}, {}, {}]'.format(self.review_type,
-            self.review, self.owner, self.state, self.date)
+            self.url, self.owner, self.state, self.date)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
 
     @property
     def age(self):
@@ -166,18 +232,30 @@ class Review(object):
 class GithubReview(Review):
 
     '''A github pull request review.'''
-    def __init__(self, handle, url, owner, state, date):
-        date = pytz.utc.localize(date)
+    __slots__ = ()
+
+    def __init__(self, url, owner, state, date):
+        date = to_utc(date)
 
         super(GithubReview, self).__init__(
-            'github', handle, url, owner, state, date)
+            'github', url, owner, state, date)
 
 
 class LaunchpadReview(Review):
     '''A launchpad merge proposal review.'''
-    def __init__(self, handle, url, owner, state, date):
+    __slots__ = ()
+
+    def __init__(self, url, owner, state, date):
         super(LaunchpadReview, self).__init__(
-            'launchpad', handle, url, owner, state, date)
+            'launchpad', url, owner, state, date)
+
+
+def to_utc(date):
+    '''Return a utc datetime for a github date, which is naive utc from
+    the snapshot and GraphQL, and timezone aware from PyGithub.'''
+    if date.tzinfo is None:
+        return pytz.utc.localize(date)
+    return date.astimezone(pytz.utc)
 
 
 def date_to_age(date):
@@ -185,8 +263,16 @@ def date_to_age(date):
         return None
     if date == '':
         return None
+    return get_age(NOW, date)
+
+
+@functools.lru_cache(maxsize=AGE_CACHE_SIZE)
+def get_age(now, date):
+    '''Return the humanized age of date at now.
 
-    age = NOW - date
+    The ages are computed as the templates read them, once for the row key
+    and again for the row, so they are kept for the same now.'''
+    age = now - date
     if age < datetime.timedelta():
         # A negative timedelta means the time is in the future; this will be
         # due to inconsistent clocks across systems, so assume that there is no
@@ -195,88 +281,214 @@ def date_to_age(date):
     return humanize.naturaltime(age)
 
 
-def merge_two_dicts(x, y):
-    """Given two dicts, merge them into a new dict as a shallow copy."""
-    z = x.copy()
-    z.update(y)
-    return z
-
+def get_all_repos(gh, sources, concurrency=1, snapshot=None,
+                  incremental=False, scheduler=None):
+    '''Return all repos, prs and reviews for the given github sources.
+
+    Repositories, and the reviews and comments of their pull requests, are
+    fetched by up to `concurrency` worker threads. With a snapshot, the
+    snapshot is updated with the pull requests fetched and, if
+    incremental, only the pull requests updated since the snapshot are
+    fetched. With a RateLimitScheduler, the repositories that do not fit in
+    the rate limit are restored from the snapshot instead.'''
+    names = [(org, name) for org in sources for name in sources[org]]
+    keys = [get_repo_key(org, name) for org, name in names]
+    if scheduler is None:
+        planned = set(keys)
+    else:
+        planned = scheduler.plan(keys, snapshot, incremental)
+    since_snapshot = snapshot if incremental else None
+    planned_names = [(org, name) for (org, name), key in zip(names, keys)
+                     if key in planned]
+    fetched = dict(zip(planned_names, Parallel(
+        n_jobs=concurrency, prefer='threads')(
+            delayed(call_scheduled)(scheduler, get_repo_pulls, gh, org, name,
+                                    since_snapshot)
+            for org, name in planned_names)))
+
+    github_repos = []
+    pr_jobs = []
+    for org, name in names:
+        if fetched.get((org, name)) is None:
+            github_repos.append(None)
+            continue
+        repo, pulls, complete = fetched[(org, name)]
+        review_count = sources[org][name]['review-count']
+        gr = GithubRepo(repo.html_url, repo.ssh_url)
+        repo_pr_jobs = add_repo_prs(gr, get_repo_key(org, name), pulls,
+                                    review_count, snapshot, complete)
+        github_repos.append((gr, pulls, repo_pr_jobs, complete,
+                             len(pr_jobs)))
+        pr_jobs.extend(repo_pr_jobs)
+
+    activities = get_prs_activity([p for _, p in pr_jobs], concurrency,
+                                  scheduler)
 
-def get_all_repos(gh, sources):
-    '''Return all repos, prs and reviews for the given github sources.'''
     repos = []
-    for org in sources:
-        for name, data in sources[org].items():
-            repo = gh.get_repo('{}/{}'.format(org.replace(' ', ''), name))
-            review_count = sources[org][name]['review-count']
-            gr = GithubRepo(repo, repo.html_url, repo.ssh_url)
-            get_prs(gr, repo, review_count)
-            if gr.pull_request_count > 0:
-                repos.append(gr)
-            print(gr)
+    for (org, name), key, github_repo in zip(names, keys, github_repos):
+        gr = None
+        if github_repo is not None:
+            gr, pulls, repo_pr_jobs, complete, offset = github_repo
+            repo_activities = activities[offset:offset + len(repo_pr_jobs)]
+            if any(None in activity for activity in repo_activities):
+                gr = None
+            else:
+                for (pr, p), activity in zip(repo_pr_jobs, repo_activities):
+                    add_pr_activity(pr, *activity)
+                if snapshot is not None:
+                    snapshot.update(key, gr, pulls, repo_pr_jobs, complete)
+        if gr is None:
+            gr = get_cached_repo(snapshot, key,
+                                 sources[org][name]['review-count'],
+                                 scheduler)
+            if gr is None:
+                continue
+        elif scheduler is not None:
+            scheduler.cached.discard(key)
+            scheduler.skipped.discard(key)
+        if gr.pull_request_count > 0:
+            repos.append(gr)
+        print(gr)
     return repos
 
 
-def get_prs(gr, repo, review_count):
-    '''Return all pull request for the given repository.'''
-    pull_requests = []
-    pulls = repo.get_pulls()
-    for p in pulls:
-        pr = GithubPullRequest(p, p.html_url, p.title, p.user.login,
-                            p.state, p.created_at, review_count)
+def call_scheduled(scheduler, func, *args):
+    '''Call func through the rate limit scheduler, if there is one.'''
+    if scheduler is None:
+        return func(*args)
+    return scheduler.call(func, *args)
+
+
+def get_cached_repo(snapshot, key, review_count, scheduler):
+    '''Return the github repository stored in the snapshot for a repo that
+    was not fetched within the rate limit, or None.'''
+    gr = None
+    if snapshot is not None:
+        gr = snapshot.get_repo(key, review_count)
+    if gr is None:
+        print("*** Skipping {}: over the github rate limit and not "
+              "cached ***".format(key))
+        scheduler.skipped.add(key)
+    else:
+        print("Using cached {}: over the github rate limit".format(key))
+        scheduler.cached.add(key)
+    return gr
+
+
+def get_repo_key(org, name):
+    '''Return the 'org/name' full name of a configured github repository.'''
+    return '{}/{}'.format(org.replace(' ', ''), name)
+
+
+def get_repo_pulls(gh, org, name, snapshot=None):
+    '''Return a github repository and the pull requests to collect for it.
+
+    The result is a (repo, pulls, complete) tuple. Unless the snapshot
+    holds the repository, pulls are all of its open pull requests and
+    complete is True. Otherwise pulls are the pull requests, open or
+    closed, updated since the snapshot.'''
+    repo = gh.get_repo(get_repo_key(org, name))
+    since = None
+    if snapshot is not None:
+        since = snapshot.updated_at(get_repo_key(org, name))
+    if since is None:
+        return repo, list(repo.get_pulls()), True
+    pulls = []
+    # Pages are fetched lazily so listing stops at the first page holding
+    # a pull request that has not changed since the snapshot
+    for p in repo.get_pulls(state='all', sort='updated', direction='desc'):
+        if to_utc(p.updated_at) <= since:
+            break
+        pulls.append(p)
+    return repo, pulls, False
+
+
+def add_repo_prs(gr, key, pulls, review_count, snapshot=None, complete=True):
+    '''Add the pull requests of a github repository.
+
+    New pull requests are built for the open pulls; unless complete, the
+    unchanged ones are restored from the snapshot. Returns a
+    (GithubPullRequest, pull) tuple for each pull whose reviews and
+    comments need to be fetched.'''
+    pr_jobs = [(get_github_pr(p, review_count), p)
+               for p in pulls if p.state == 'open']
+    pull_requests = [pr for pr, _ in pr_jobs]
+    if not complete:
+        changed = set(p.number for p in pulls)
+        pull_requests.extend(pr for number, pr in
+                             snapshot.get_prs(key, review_count)
+                             if number not in changed)
+        # Keep the newest first order of a complete listing
+        pull_requests.sort(key=lambda pr: pr.date, reverse=True)
+    for pr in pull_requests:
         gr.add(pr)
-        pull_requests.append(pr)
-        raw_reviews = p.get_reviews()
-        raw_comments = p.get_comments()
-        raw_issue_comments = p.get_issue_comments()
-        pr_latest_activity = pytz.utc.localize(p.created_at)
-
-        # Find most recent issue comment activity on pull request
-        for raw_issue_comment in raw_issue_comments:
-            issue_comment_created_at = pytz.utc.localize(
-                raw_issue_comment.created_at)
-            if pr_latest_activity is None or (
-                    issue_comment_created_at > pr_latest_activity):
-                pr_latest_activity = issue_comment_created_at
-
-        # Find most recent comment activity on pull request
-        for raw_comment in raw_comments:
-            comment_created_at = pytz.utc.localize(
-                raw_comment.created_at)
-            if pr_latest_activity is None or (
-                    comment_created_at > pr_latest_activity):
-                pr_latest_activity = comment_created_at
-
-        for raw_review in raw_reviews:
-            if raw_review.state == 'PENDING':
-                continue
-            owner = raw_review.user.login
-            review = GithubReview(raw_review, raw_review.html_url, owner,
-                                  raw_review.state, raw_review.submitted_at)
-            pr.add_review(review)
-            review_date = pytz.utc.localize(raw_review.submitted_at)
-            # Review might be more recent than a comment
-            if pr_latest_activity is None or review_date > pr_latest_activity:
-                pr_latest_activity = review_date
+    return pr_jobs
+
 
-        pr.latest_activity = pr_latest_activity
+def get_github_pr(p, review_count):
+    '''Return a GithubPullRequest for the given raw pull request.'''
+    return GithubPullRequest(p.html_url, p.title, p.user.login,
+                             p.state, p.created_at, review_count)
 
-    return pull_requests
 
+def get_paginated(handle, method):
+    '''Call a paginated list method of handle and fetch every page.'''
+    return list(getattr(handle, method)())
 
-def get_pr_data(pull_requests):
-    '''Render the list of provided pull_requests.'''
-    pr_data = []
-    for p in pull_requests:
-        pr_data.append(merge_two_dicts(p.__dict__, {
-            'age': p.age,
-            'id': p.mp_id,
-            'latest_activity_age': p.latest_activity_age}))
-    return pr_data
+
+def get_prs_activity(pulls, concurrency=1, scheduler=None):
+    '''Return the reviews, comments and issue comments for each pull.
+
+    The three collections of every pull request are fetched as separate
+    jobs so that up to `concurrency` of them run at the same time. The
+    result holds a (reviews, comments, issue_comments) tuple per pull, in
+    the same order as `pulls`; with a scheduler, a collection is None when
+    it could not be fetched within the rate limit.'''
+    results = Parallel(n_jobs=concurrency, prefer='threads')(
+        delayed(call_scheduled)(scheduler, get_paginated, p, method)
+        for p in pulls for method in PR_ACTIVITY_METHODS)
+    step = len(PR_ACTIVITY_METHODS)
+    return [tuple(results[i:i + step]) for i in range(0, len(results), step)]
+
+
+def add_pr_activity(pr, raw_reviews, raw_comments, raw_issue_comments):
+    '''Add the reviews and latest activity date to a github pull request.'''
+    pr_latest_activity = pr.date
+
+    # Find most recent issue comment activity on pull request
+    for raw_issue_comment in raw_issue_comments:
+        issue_comment_created_at = to_utc(raw_issue_comment.created_at)
+        if pr_latest_activity is None or (
+                issue_comment_created_at > pr_latest_activity):
+            pr_latest_activity = issue_comment_created_at
+
+    # Find most recent comment activity on pull request
+    for raw_comment in raw_comments:
+        comment_created_at = to_utc(raw_comment.created_at)
+        if pr_latest_activity is None or (
+                comment_created_at > pr_latest_activity):
+            pr_latest_activity = comment_created_at
+
+    for raw_review in raw_reviews:
+        if raw_review.state == 'PENDING':
+            continue
+        owner = raw_review.user.login
+        review = GithubReview(raw_review.html_url, owner,
+                              raw_review.state, raw_review.submitted_at)
+        pr.add_review(review)
+        review_date = to_utc(raw_review.submitted_at)
+        # Review might be more recent than a comment
+        if pr_latest_activity is None or review_date > pr_latest_activity:
+            pr_latest_activity = review_date
+
+    pr.latest_activity = pr_latest_activity
 
 
 def get_repo_data(repos):
-    '''Render the list of repos, their prs and reviews into an html table.'''
+    '''Render the list of repos, their prs and reviews into an html table.
+
+    The pull requests and reviews are passed to the templates as they are,
+    computing their ages as they are rendered.'''
     repo_data = {}
     for repo in repos:
         repo_data[repo.name] = {
@@ -284,209 +496,405 @@ def get_repo_data(repos):
             'repo_name': repo.name,
             'tox': repo.tox,
             'repo_shortname': repo.name.split('/')[-1],
-            'pull_requests': get_pr_data(repo.pull_requests)
+            'pull_requests': repo.pull_requests
         }
     return repo_data
 
 
-def report_repo_data(data):
-    for reporter_cls in REPORTER_CLASSES:
-        if reporter_cls.enabled():
-            reporter_cls().process_data(data)
-
-
-def render(repos, output_directory, tox):
-    '''Render the repositories into an html file.'''
-    data = get_repo_data(repos)
-    report_repo_data(data)
-    abs_templates_path = os.path.join(os.path.dirname(
-            os.path.realpath(__file__)), "templates")
-    abs_vendor_path = os.path.join(os.path.dirname(
-            os.path.realpath(__file__)), "vendor")
-    env = Environment(loader=FileSystemLoader(abs_templates_path))
-    tmpl = env.get_template('reviews.html')
-
-    # Make sure the output directory exists
-    os.makedirs(output_directory, exist_ok=True)
-    output_html_filepath = os.path.join(output_directory, 'reviews.html')
-    with open(output_html_filepath, 'w') as out_file:
-        context = {'repos': data, 'generation_time': NOW, 'tox': tox}
-        out_file.write(tmpl.render(context))
-        print("**** {} written ****".format(output_html_filepath))
-        print("file://{}".format(output_html_filepath))
-    output_vendor_dir = os.path.join(output_directory, 'vendor')
-    shutil.rmtree(output_vendor_dir, True)
-    # Copy the vendored CSS and JS
-    shutil.copytree(abs_vendor_path, output_vendor_dir)
+def to_timestamp(date):
+    '''Return the unix timestamp of an aware datetime, or None.'''
+    if date is None or date == '':
+        return None
+    return int(date.timestamp())
 
 
-def get_mp_title(mp):
-    '''Format a sensible MP title from git branches and the description.'''
-    title = ''
+def get_json_data(repos, tox):
+    '''Return the compact data of the repos for the json report.
+
+    Pull requests refer to their repo by its index in the list of repos and
+    dates are unix timestamps; ages are left to the reader.'''
+    json_repos = []
+    json_pull_requests = []
+    for index, repo in enumerate(repos):
+        json_repos.append({
+            'name': repo.name,
+            'url': repo.url,
+            'shortname': repo.name.split('/')[-1],
+            'tox': repo.tox,
+        })
+        for pr in repo.pull_requests:
+            json_pull_requests.append({
+                'repo': index,
+                'id': pr.mp_id,
+                'url': pr.url,
+                'title': pr.title,
+                'source': pr.source,
+                'target': pr.target,
+                'state': pr.state,
+                'owner': pr.owner,
+                'date': to_timestamp(pr.date),
+                'latest_activity': to_timestamp(pr.latest_activity),
+                'reviews': [{
+                    'owner': review.owner,
+                    'state': review.state,
+                    'date': to_timestamp(review.date),
+                } for review in pr.reviews],
+            })
+    return {
+        'version': JSON_VERSION,
+        'generated': to_timestamp(NOW),
+        'tox': tox,
+        'repos': json_repos,
+        'pull_requests': json_pull_requests,
+    }
+
+
+def report_repo_data(data, config_name=None):
+    '''Queue the repos data, of the named config if given, for the enabled
+    reporters.'''
+    dispatcher = reporters.get_dispatcher()
+    if dispatcher is not None:
+        dispatcher.submit(data, NOW, config_name)
+
+
+def render(repos, output_directory, tox, github_rate_limit=None,
+           pending=None, render_mode='html', report_store=None, report=True,
+           config_name=None):
+    '''Render the repositories into an html file and a json file.
+
+    github_rate_limit, if given, describes the use of the github rate limit
+    in the page footer. pending, if given, lists the provider sections still
+    being collected and marks the page as a partial report. In the 'json'
+    render mode the page loads the json file and renders it in the browser
+    instead of holding a table row for each pull request. With a
+    server.ReportStore, the files are published to the store rather than
+    written to the output directory. Unless report, the metrics of the repos
+    are left to the caller; config_name, if given, tags them with the config
+    of the report.'''
+    with instrumentation.phase('get_repo_data'):
+        data = get_repo_data(repos)
+    if report and not pending:
+        # A partial report would skew the metrics
+        report_repo_data(data, config_name)
+    start = time.perf_counter()
+    renderer = rendering.get_renderer(output_directory)
+
+    if report_store is None:
+        # Make sure the output directory exists
+        os.makedirs(output_directory, exist_ok=True)
+        # Publish the vendored CSS and JS before the page that refers to them
+        assets = publisher.publish_assets(output_directory)
+    else:
+        assets = report_store.assets
+    json_data = json.dumps(get_json_data(repos, tox), separators=(',', ':'))
+    context = {
+        'generation_time': NOW,
+        'assets': assets,
+        'github_rate_limit': github_rate_limit,
+        'pending': pending,
+    }
+    if render_mode == 'json':
+        html = renderer.render_client(
+            tox, data_url='reviews.json?{}'.format(to_timestamp(NOW)),
+            **context)
+    else:
+        html = renderer.render(data, tox, **context)
+    if report_store is None:
+        output_json_filepath = os.path.join(output_directory, 'reviews.json')
+        publisher.write_file(output_json_filepath, json_data)
+        output_html_filepath = os.path.join(output_directory, 'reviews.html')
+        publisher.write_file(output_html_filepath, html)
+        print("**** {} written ****".format(output_html_filepath))
+        print("file://{}".format(output_html_filepath))
+    else:
+        report_store.publish('reviews.json', json_data, 'application/json')
+        report_store.publish('reviews.html', html, 'text/html; charset=utf-8')
+        print("**** reviews.html published ****")
+    if render_mode != 'json':
+        print("{} of {} rows rendered".format(renderer.rendered_count,
+                                              renderer.row_count))
+    instrumentation.get_stats().add_phase('render',
+                                          time.perf_counter() - start)
+
+
+def get_mp_branches(mp):
+    '''Return the source and target of an MP, from git or bzr branches.'''
     git_source = mp.source_git_path
     if git_source is not None:
-        source = '<strong>'
-        source += mp.source_git_repository_link.replace(
+        source = mp.source_git_repository_link.replace(
             'https://api.launchpad.net/devel/', '')
-        source += ':' + git_source.replace('refs/heads/', '') + \
-                  '</strong> &rArr; '
-        title += source
+        source += ':' + git_source.replace('refs/heads/', '')
     else:
-        source = '<strong>'
-        source += mp.source_branch_link.replace(
+        source = mp.source_branch_link.replace(
             'https://api.launchpad.net/devel/', '')
-        source += '</strong> &rArr; '
-        title += source
     git_target = mp.target_git_path
     if git_target is not None:
         target = mp.target_git_repository_link.replace(
             'https://api.launchpad.net/devel/', '')
         target += ':' + git_target.replace('refs/heads/', '')
-        title += target
     else:
         target = mp.target_branch_link.replace(
             'https://api.launchpad.net/devel/', '')
-        title += target
+    return source, target
+
+
+def get_mp_title(mp):
+    '''Format a sensible, plain text, MP title from the description.
 
+    The source and target branches are kept apart, see get_mp_branches,
+    and shown before the title by the templates.'''
     description = mp.description
-    if description is not None:
-        description = description.split('\n')[0]
-        if len(description) > MAX_DESCRIPTION_LENGTH:
-            description = description[:MAX_DESCRIPTION_LENGTH] + '...'
-        if len(title) > 0:
-            title += '\n'
-        title += description
-    return title
+    if description is None:
+        return ''
+    description = description.split('\n')[0]
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        description = description[:MAX_DESCRIPTION_LENGTH] + '...'
+    return description
 
 
 def get_candidate_mps(branch):
     try:
-        mps = branch.getMergeProposals(status=['Needs review','Work in progress'])
+        mps = branch.getMergeProposals(status=MP_STATUSES)
     except AttributeError:
         mps = branch.landing_candidates
     return mps
 
 
-def get_mps(repo, branch, output_directory=None):
-    '''Return all merge proposals for the given branch.'''
-    mps = get_candidate_mps(branch)
-    tox_mps = []
-    for mp in mps:
-        _, owner = mp.registrant_link.split('~')
-        title = get_mp_title(mp)
-
-        pr = LaunchpadPullRequest(mp, mp.web_link, title, owner,
-                                  mp.queue_status,
-                                  mp.date_created, 2)
-        repo.add(pr)
-        mp_latest_activity = None
-
-        if repo.tox and pr.state == 'Needs review':
-            repo.add_requiring_tox(mp)
-
-        # Find most recent activity on merge proposal
-        for mp_comment in mp.all_comments:
-            if mp_latest_activity is None or \
-                            mp_comment.date_created > mp_latest_activity:
-                mp_latest_activity = mp_comment.date_created
-
-        for vote in mp.votes:
-            owner = vote.reviewer.display_name
-            comment = vote.comment
-            result = 'EMPTY'
-            review_date = vote.date_created
-            if comment is not None:
-                result = comment.vote
-                review_date = comment.date_created
-            review = LaunchpadReview(vote, vote.web_link, owner, result,
-                                     review_date)
-
-            # MP Vote might be more recent than a comment
-            if mp_latest_activity is None or review_date > mp_latest_activity:
-                mp_latest_activity = review_date
-            pr.add_review(review)
-
-        pr.latest_activity = mp_latest_activity
-
-
-def get_branches_for_owner(lp, collected, owner, max_age):
+def add_mps(lp_sessions, repo_mps, concurrency=1):
+    '''Add merge proposals, with their reviews, to launchpad repositories.
+
+    repo_mps holds (repo, mps) tuples. With a concurrency above 1 the
+    merge proposals are walked by a pool of threads, each loading them
+    again, by their link, in its own launchpad session.'''
+    if concurrency == 1:
+        for repo, mps in repo_mps:
+            for mp in mps:
+                add_mp_pr(repo, get_mp_pr(mp, repo.tox))
+        return
+    mp_links = [(repo, mp.self_link) for repo, mps in repo_mps for mp in mps]
+    prs = Parallel(n_jobs=concurrency, prefer='threads')(
+        delayed(load_mp_pr)(lp_sessions, mp_link, repo.tox)
+        for repo, mp_link in mp_links)
+    for (repo, _), pr in zip(mp_links, prs):
+        add_mp_pr(repo, pr)
+
+
+def add_mp_pr(repo, pr):
+    '''Add a merge proposal to a launchpad repository.'''
+    repo.add(pr)
+    if pr.tox_job is not None:
+        repo.add_requiring_tox(pr.tox_job)
+
+
+def get_mp_pr(mp, tox=False):
+    '''Return a LaunchpadPullRequest, with its reviews, for the given mp.
+
+    With tox, the tox_runner.ToxJob of a merge proposal needing review is
+    extracted as well.'''
+    _, owner = mp.registrant_link.split('~')
+    title = get_mp_title(mp)
+    source, target = get_mp_branches(mp)
+
+    pr = LaunchpadPullRequest(mp.web_link, title, owner,
+                              mp.queue_status,
+                              mp.date_created, 2,
+                              source=source, target=target)
+    mp_latest_activity = None
+
+    # Find most recent activity on merge proposal
+    for mp_comment in mp.all_comments:
+        if mp_latest_activity is None or \
+                        mp_comment.date_created > mp_latest_activity:
+            mp_latest_activity = mp_comment.date_created
+
+    for vote in mp.votes:
+        owner = vote.reviewer.display_name
+        comment = vote.comment
+        result = 'EMPTY'
+        review_date = vote.date_created
+        if comment is not None:
+            result = comment.vote
+            review_date = comment.date_created
+        review = LaunchpadReview(vote.web_link, owner, result, review_date)
+
+        # MP Vote might be more recent than a comment
+        if mp_latest_activity is None or review_date > mp_latest_activity:
+            mp_latest_activity = review_date
+        pr.add_review(review)
+
+    pr.latest_activity = mp_latest_activity
+    if tox and pr.state == 'Needs review':
+        pr.tox_job = tox_runner.ToxJob(
+            mp.source_git_repository.display_name,
+            _format_git_branch_name(mp.source_git_path),
+            pr.mp_id, (pr.latest_activity or pr.date).timestamp(),
+            getattr(mp, 'source_git_commit_sha1', None))
+    return pr
+
+
+def find_lp_branch(lp_sessions, lookup):
+    '''Return a branch, using the session of the calling thread, and the
+    list of its candidate merge proposals.'''
+    with lp_sessions.session() as lp:
+        b = lookup(lp)
+        return b, list(get_candidate_mps(b))
+
+
+def load_mp_pr(lp_sessions, mp_link, tox=False):
+    '''Return the LaunchpadPullRequest for a merge proposal link, using the
+    session of the calling thread.'''
+    with lp_sessions.session() as lp:
+        return get_mp_pr(lp.load(mp_link), tox)
+
+
+def get_launchpad_repos(lp_sessions, lookups, concurrency=1):
+    '''Return a LaunchpadRepo, with its merge proposals, for each lookup.
+
+    lookups holds (lookup, tox) tuples where lookup returns a launchpad
+    branch or git repository given a launchpad session. With a concurrency
+    above 1, branches and then merge proposals are fetched by a pool of
+    threads each using its own launchpad session.'''
+    if concurrency == 1:
+        with lp_sessions.session() as lp:
+            found = [(b, get_candidate_mps(b))
+                     for b in (lookup(lp) for lookup, _ in lookups)]
+    else:
+        found = Parallel(n_jobs=concurrency, prefer='threads')(
+            delayed(find_lp_branch)(lp_sessions, lookup)
+            for lookup, _ in lookups)
+    repos = []
+    repo_mps = []
+    for (b, mps), (_, tox) in zip(found, lookups):
+        repo = LaunchpadRepo(b.web_link, b.display_name)
+        repo.tox = tox
+        repos.append(repo)
+        repo_mps.append((repo, mps))
+    add_mps(lp_sessions, repo_mps, concurrency)
+    return repos
+
+
+def get_collected(repos):
+    '''Return the names of repos and the links of their merge proposals.'''
+    collected = set()
+    for repo in repos:
+        collected.add(repo.name)
+        collected.update(pr.url for pr in repo.pull_requests)
+    return collected
+
+
+def get_owner_branches(lp, owner, age_gate, git=False):
+    '''Return the bzr branches, or git repositories when git is True, of
+    owner modified since age_gate.'''
+    person = lp.people(owner)
+    if git:
+        return list(lp.git_repositories.getRepositories(
+            target=person, modified_since_date=age_gate))
+    return list(person.getBranches(modified_since=age_gate))
+
+
+def get_branches_for_owner(lp_sessions, collected, owner, max_age,
+                           concurrency=1, git=False):
     '''Return all repos and prs for the given owner with the age limit.
 
     This is used to identify any recently submitted prs that escaped the
-    whitelist of launchpad repositories. This only applies to launchpad.'''
+    whitelist of launchpad repositories. The merge proposals targeting the
+    bzr branches, or git repositories when git is True, that the owner
+    modified within max_age days are listed, the branches being queried by
+    up to `concurrency` threads. Branches and merge proposals in the
+    `collected` set are skipped.'''
     age_gate = NOW - datetime.timedelta(days=max_age)
-    team = lp.people(owner)
-    branches = team.getBranches(modified_since=age_gate)
+    with lp_sessions.session() as lp:
+        branches = [b for b in get_owner_branches(lp, owner, age_gate, git)
+                    if b.display_name not in collected]
+    if concurrency == 1:
+        lookups = [(lambda lp, b=b: b, False) for b in branches]
+    else:
+        # Each thread loads the branch again in its own session
+        lookups = [(lambda lp, link=b.self_link: lp.load(link), False)
+                   for b in branches]
     repos = []
-    for b in branches:
-        # XXX: Add logic to skip branches we already have
-        if b.display_name in collected:
-            continue
-        branch = LaunchpadRepo(b, b.web_link, b.display_name)
-        get_mps(branch, b)
-        if branch.pull_request_count > 0:
-            repos.append(branch)
+    for repo in get_launchpad_repos(lp_sessions, lookups, concurrency):
+        repo.pull_requests = [pr for pr in repo.pull_requests
+                              if pr.url not in collected]
+        if repo.pull_request_count > 0:
+            repos.append(repo)
     return repos
 
 
-def get_branches(sources, lp_credentials_store=None):
+def get_branches(sources, lp_sessions, concurrency=1):
     '''Return all repos, prs and reviews for the given launchpad sources.'''
-    # deferred import of launchpadagent until required
-    from . import launchpadagent
-    cachedir_prefix = os.environ.get('SNAP_USER_COMMON', "/tmp")
-    launchpad_cachedir = os.path.join('{}/get_reviews/.launchpadlib'.format(cachedir_prefix))
-    # deferred import of launchpadagent until required
-    from . import launchpadagent
-    lp = launchpadagent.get_launchpad(
-        launchpadlib_dir=launchpad_cachedir,
-        lp_credentials_store=lp_credentials_store)
-    repos = []
-    for source, data in sources['branches'].items():
-        print(source, data)
-        b = lp.branches.getByUrl(url=source)
-        repo = LaunchpadRepo(b, b.web_link, b.display_name)
-        get_mps(repo, b)
-        if repo.pull_request_count > 0:
-            repos.append(repo)
-        print(repo)
-    collected = [r.name for r in repos]
-    print('collected: {}'.format(collected))
-    for owner, data in sources['owners'].items():
-        print(owner, data)
-        repos.extend(get_branches_for_owner(
-            lp, collected, owner, data['max-age']))
+    # The calling thread holds a session throughout so that launchpad
+    # objects it walks lazily are not used by another thread meanwhile
+    with lp_sessions.session():
+        lookups = []
+        for source, data in sources['branches'].items():
+            print(source, data)
+            lookups.append(
+                (lambda lp, url=source: lp.branches.getByUrl(url=url), False))
+        repos = []
+        for repo in get_launchpad_repos(lp_sessions, lookups, concurrency):
+            if repo.pull_request_count > 0:
+                repos.append(repo)
+            print(repo)
+        collected = get_collected(repos)
+        print('collected: {}'.format(sorted(r.name for r in repos)))
+        for owner, data in sources['owners'].items():
+            print(owner, data)
+            repos.extend(get_branches_for_owner(
+                lp_sessions, collected, owner, data['max-age'], concurrency))
     return repos
 
 
-def get_lp_repos(sources, output_directory=None, lp_credentials_store=None):
+def get_lp_repos(sources, lp_sessions, concurrency=1):
     '''Return all repos, prs and reviews for the given lp-git source.'''
-    # deferred import of launchpadagent until required
-    from . import launchpadagent
-    cachedir_prefix = os.environ.get('SNAP_USER_COMMON', "/tmp")
-    launchpad_cachedir = os.path.join('{}/get_reviews/.launchpadlib'.format(cachedir_prefix))
-    lp = launchpadagent.get_launchpad(
-        launchpadlib_dir=launchpad_cachedir,
-        lp_credentials_store=lp_credentials_store)
-    repos = []
-    for source, data in sources['repos'].items():
-        print(source, data)
-        b = lp.git_repositories.getByPath(path=source.replace('lp:', ''))
-        repo = LaunchpadRepo(b, b.web_link, b.display_name)
-        repo.tox = data.get('tox', False)
-        get_mps(repo, b, output_directory)
-        if repo.pull_request_count > 0:
-            repos.append(repo)
-        print(repo)
+    # The calling thread holds a session throughout so that launchpad
+    # objects it walks lazily are not used by another thread meanwhile
+    with lp_sessions.session():
+        lookups = []
+        for source, data in sources['repos'].items():
+            print(source, data)
+            path = source.replace('lp:', '')
+            lookups.append(
+                (lambda lp, path=path: lp.git_repositories.getByPath(
+                    path=path), data.get('tox', False)))
+        repos = []
+        for repo in get_launchpad_repos(lp_sessions, lookups, concurrency):
+            if repo.pull_request_count > 0:
+                repos.append(repo)
+            print(repo)
+        collected = get_collected(repos)
+        for owner, data in sources.get('owners', {}).items():
+            print(owner, data)
+            repos.extend(get_branches_for_owner(
+                lp_sessions, collected, owner, data['max-age'], concurrency,
+                git=True))
     return repos
 
 
-def get_repos(sources, github_username, github_password, github_token):
-    if github_token:
-        gh = github.Github(github_token)
-    elif github_username and github_password:
-        gh = github.Github(github_username,
-                           github_password)
-    else:
+def get_repos(sources, sessions, backend='rest', incremental=False,
+              concurrency=None):
+    '''Return all repos, prs and reviews for the given github sources.
+
+    The GraphQL backend collects every open pull request, without the github
+    snapshot or the rate limit scheduler of the REST backend.'''
+    if concurrency is None:
+        concurrency = sessions.github_concurrency
+    if backend == 'graphql':
+        client = sessions.github_graphql()
+        if client is not None:
+            # deferred import of github_graphql until required
+            from . import github_graphql
+            if incremental:
+                print("*** --incremental is ignored by the github GraphQL "
+                      "backend ***")
+            query_count = client.query_count
+            repos = github_graphql.get_all_repos(client, sources['repos'])
+            print("{} github GraphQL queries".format(
+                client.query_count - query_count))
+            return repos
+        print("*** The github GraphQL backend requires a Github token ***")
+    gh = sessions.github()
+    if gh is None:
         print("*** You have configured Github repositories but not supplied "
               "any Github credentials ***")
         print("You can either pass these values to review-gator or set "
@@ -496,7 +904,14 @@ def get_repos(sources, github_username, github_password, github_token):
               "Github repositories.")
         return []
 
-    repos = get_all_repos(gh, sources['repos'])
+    # The snapshot is kept even when not incremental, as the fallback for
+    # repos that do not fit in the rate limit
+    github_snapshot = sessions.github_snapshot()
+    scheduler = sessions.github_rate_limit()
+    repos = get_all_repos(gh, sources['repos'], concurrency, github_snapshot,
+                          incremental, scheduler)
+    github_snapshot.save()
+    print("github rate limit: {}".format(scheduler))
     return repos
 
 
@@ -506,53 +921,388 @@ def get_sources(source):
     return data
 
 
-def aggregate_reviews(sources, output_directory, github_password, github_token,
-                      github_username, tox, lp_credentials_store):
+def collect_section(section, sources, sessions, concurrency,
+                    github_backend='rest', incremental=False):
+    '''Return the repos of a provider section of the config.'''
+    if section == 'lp-git':
+        return sessions.call(api_sessions.LAUNCHPAD, get_lp_repos,
+                             sources, sessions.launchpad(), concurrency)
+    if section == 'launchpad':
+        return sessions.call(api_sessions.LAUNCHPAD, get_branches,
+                             sources, sessions.launchpad(), concurrency)
+    return sessions.call(api_sessions.GITHUB, get_repos, sources, sessions,
+                         github_backend, incremental, concurrency)
+
+
+class CollectionProgress(object):
+    '''The repos collected so far from the provider sections of a config.
+
+    If given, publish is called with the repos collected so far, in config
+    order, and the sections still being collected each time a section
+    other than the last one finishes.'''
+
+    def __init__(self, sections, publish=None):
+        self.sections = sections
+        self.publish = publish
+        self.collected = {}
+        self._lock = threading.Lock()
+
+    @property
+    def repos(self):
+        return [repo for section in self.sections
+                for repo in self.collected.get(section, [])]
+
+    def add(self, section, repos):
+        '''Record the repos of a finished section.'''
+        with self._lock:
+            self.collected[section] = repos
+            pending = [pending_section for pending_section in self.sections
+                       if pending_section not in self.collected]
+            if pending and self.publish is not None:
+                self.publish(self.repos, pending)
+
+
+def timed_collect_section(progress, section, *args, **kwargs):
+    '''Collect a provider section, reporting the time it took.'''
+    start = time.time()
+    repos = collect_section(section, *args, **kwargs)
+    elapsed = time.time() - start
+    instrumentation.get_stats().add_phase('collect {}'.format(section),
+                                          elapsed)
+    print("Collected {} repos from {} in {:.1f}s".format(
+        len(repos), section, elapsed))
+    progress.add(section, repos)
+
+
+def collect_repos(sources, sessions, github_backend='rest',
+                  incremental=False, publish=None):
+    '''Return the repos of every provider section of the config.
+
+    The sections are collected at the same time, their requests sharing
+    the concurrency budget of sessions, and their repos are merged in the
+    order the sections appear in the config. publish, if given, is called
+    as each section finishes; see CollectionProgress.'''
+    sections = [section for section in sources
+                if section in PROVIDER_SECTIONS]
+    progress = CollectionProgress(sections, publish)
+    Parallel(n_jobs=max(1, len(sections)), prefer='threads')(
+        delayed(timed_collect_section)(
+            progress, section, sources[section], sessions,
+            sessions.budget(PROVIDER_SECTIONS[section]),
+            github_backend, incremental)
+        for section in sections)
+    return progress.repos
+
+
+def render_partial(repos, pending, output_directory, tox,
+                   render_mode='html', report_store=None):
+    '''Render the repositories collected so far, marked as partial.'''
+    print("**** Publishing partial report, waiting for {} ****".format(
+        ', '.join(pending)))
+    render(repos, output_directory, tox, pending=pending,
+           render_mode=render_mode, report_store=report_store)
+
+
+def publish_stats(output_directory, report_store=None):
+    '''Write the instrumentation stats of the current cycle, with the hit
+    rate of the row cache, next to the report.'''
+    stats = instrumentation.get_stats()
+    stats.record_cache('rows',
+                       rendering.get_renderer(output_directory).stats)
+    stats_json = stats.to_json()
+    if report_store is None:
+        publisher.write_file(os.path.join(output_directory, STATS_FILENAME),
+                             stats_json)
+    else:
+        report_store.publish(STATS_FILENAME, stats_json, 'application/json')
+
+
+def save_report_snapshot(path, repos):
+    '''Save the collected repos to the report snapshot at path.'''
+    # deferred import of snapshot until required
+    from . import snapshot
+    snapshot.save_report(path, repos, NOW)
+    print("**** {} written ****".format(path))
+
+
+def replay_snapshot(path, output_directory, tox, render_mode='html',
+                    report_store=None):
+    '''Render the report, and run the reporters, from the repos of the
+    report snapshot at path, as of when they were collected.'''
+    global NOW
+    # deferred import of snapshot until required
+    from . import snapshot
+    repos, NOW = snapshot.load_report(path)
+    render(repos, output_directory, tox, render_mode=render_mode,
+           report_store=report_store)
+    publish_stats(output_directory, report_store)
+    print("Rendered {} repos collected @ {}".format(
+        len(repos), format_datetime(NOW)))
+
+
+def update_now():
+    '''Set the time ages are computed against to the current time.'''
+    global NOW
+    NOW = pytz.utc.localize(datetime.datetime.utcnow())
+
+
+def get_github_keys(sources):
+    '''Return the 'org/name' of each repository of the github config.'''
+    return [get_repo_key(org, name)
+            for org in sources['repos'] for name in sources['repos'][org]]
+
+
+def get_tox_jobs(repos):
+    '''Return a tox_runner.ToxJob for each merge proposal of repos requiring
+    tox.'''
+    return [tox_job for repo in repos
+            for tox_job in repo.pull_requests_requiring_tox]
+
+
+def plan_entries(due, sessions, github_backend='rest', incremental=False):
+    '''Plan the github repos of the scheduler entries due together on the
+    rate limit scheduler of the session, in priority order across all of
+    them.'''
+    keys = [key for entry in due if entry.section == 'github'
+            for key in get_github_keys(entry.sources)]
+    if not keys or (github_backend == 'graphql' and sessions.github_token):
+        return
+    scheduler = sessions.github_rate_limit()
+    if scheduler is not None:
+        scheduler.plan_ahead(keys, sessions.github_snapshot(), incremental)
+
+
+def collect_entry(entry, sessions, tox, workers, github_backend='rest',
+                  incremental=False):
+    '''Return the repos of a scheduler entry, and record the tox jobs they
+    require.'''
+    concurrency = sessions.budget(PROVIDER_SECTIONS[entry.section])
+    with instrumentation.phase('collect {}'.format(entry.section)):
+        repos = collect_section(entry.section, entry.sources, sessions,
+                                concurrency, github_backend, incremental)
+    if tox:
+        entry.tox_jobs = get_tox_jobs(repos)
+    return repos
+
+
+def get_entries_repos(entries, config=None):
+    '''Return the latest repos of the entries, in config order.
+
+    As in a single collection, owner entries leave out the repos and merge
+    proposals collected by the other entries of their section. With config,
+    the config of each entry of a config sharing them, the repos get the
+    tox and review-count of that config.'''
+    collected = collections.defaultdict(set)
+    for entry in entries:
+        if entry.kind != 'owners' and entry.repos:
+            collected[entry.section].update(get_collected(entry.repos))
+    repos = []
+    for entry in entries:
+        for repo in entry.repos or []:
+            if entry.kind == 'owners':
+                if repo.name in collected[entry.section]:
+                    continue
+                repo = copy.copy(repo)
+                repo.pull_requests = [
+                    pr for pr in repo.pull_requests
+                    if pr.url not in collected[entry.section]]
+                if not repo.pull_requests:
+                    continue
+            if config is not None:
+                repo = apply_config(repo, config[entry])
+            repos.append(repo)
+    return repos
+
+
+def apply_config(repo, data):
+    '''Return repo with the tox and review-count of the config data of its
+    entry, copying the repo and pull requests that differ.'''
+    tox = data.get('tox', False)
+    review_count = data.get('review-count')
+    if repo.tox != tox:
+        repo = copy.copy(repo)
+        repo.tox = tox
+    if review_count is not None and any(
+            pr.review_count != review_count for pr in repo.pull_requests):
+        repo = copy.copy(repo)
+        pull_requests = []
+        for pr in repo.pull_requests:
+            if pr.review_count != review_count:
+                pr = copy.copy(pr)
+                pr.review_count = review_count
+            pull_requests.append(pr)
+        repo.pull_requests = pull_requests
+    return repo
+
+
+def get_pending(entries):
+    '''Return the sections of the scheduler entries not yet collected.'''
+    pending = []
+    for entry in entries:
+        if entry.repos is None and entry.section not in pending:
+            pending.append(entry.section)
+    return pending
+
+
+def publish_entries(entries, finished, output_directory, sessions, tox,
+                    render_mode='html', report_store=None, tox_queue=None,
+                    snapshot_path=None):
+    '''Queue the tox runs of the scheduler entries just collected on
+    tox_queue, then render the latest repos of the entries, saving them to
+    the report snapshot at snapshot_path if given.'''
+    update_now()
+    if tox_queue is not None:
+        for entry in finished:
+            tox_queue.submit(entry.tox_jobs)
+    pending = get_pending(entries)
+    repos = get_entries_repos(entries)
+    if snapshot_path is not None:
+        save_report_snapshot(snapshot_path, repos)
+    render(repos, output_directory, tox, sessions.github_scheduler,
+           pending=pending or None, render_mode=render_mode,
+           report_store=report_store)
+    sessions.end_cycle()
+    publish_stats(output_directory, report_store)
+    instrumentation.end_cycle()
+    print("Last run @ {}".format(format_datetime(NOW)))
+
+
+def publish_reports(entries, finished, reports, sessions, tox,
+                    render_mode='html', tox_queue=None):
+    '''Queue the tox runs of the shared scheduler entries just collected on
+    tox_queue, then render the report of each config from the latest repos
+    of its own entries.
+
+    reports holds a (config, output_directory) tuple for each config, where
+    config is the config of each of its entries. The metrics of each
+    config are reported on their own, tagged with the name of its output
+    directory.'''
+    update_now()
+    if tox_queue is not None:
+        for entry in finished:
+            tox_queue.submit(entry.tox_jobs)
+    for config, output_directory in reports:
+        pending = get_pending(config)
+        render(get_entries_repos(list(config), config), output_directory,
+               tox, sessions.github_scheduler, pending=pending or None,
+               render_mode=render_mode,
+               config_name=os.path.basename(output_directory))
+    sessions.end_cycle()
+    for _, output_directory in reports:
+        publish_stats(output_directory)
+    instrumentation.end_cycle()
+    print("Last run @ {}".format(format_datetime(NOW)))
+
+
+def run_scheduler(sources, output_directory, sessions, tox, poll_interval,
+                  workers, github_backend='rest', incremental=False,
+                  render_mode='html', report_store=None, tox_queue=None,
+                  snapshot_path=None):
+    '''Poll every repository, branch and owner of the config on its own
+    schedule, forever.'''
+    # deferred import of scheduler until required
+    from . import scheduler
+    entries = scheduler.get_entries(
+        sources, [section for section in sources
+                  if section in PROVIDER_SECTIONS], poll_interval)
+    for entry in entries:
+        print(entry)
+    scheduler.Scheduler(
+        entries,
+        functools.partial(collect_entry, sessions=sessions, tox=tox,
+                          workers=workers, github_backend=github_backend,
+                          incremental=incremental),
+        functools.partial(publish_entries,
+                          output_directory=output_directory,
+                          sessions=sessions, tox=tox,
+                          render_mode=render_mode, report_store=report_store,
+                          tox_queue=tox_queue, snapshot_path=snapshot_path),
+        workers,
+        functools.partial(plan_entries, sessions=sessions,
+                          github_backend=github_backend,
+                          incremental=incremental)).run_forever()
+
+
+def aggregate_configs(configs, output_directories, sessions, tox,
+                      poll_interval, workers, github_backend='rest',
+                      incremental=False, progressive=False,
+                      render_mode='html', tox_queue=None, poll=False):
+    '''Render a report of each config to its output directory, collecting
+    each repository, branch and owner configured by several configs once
+    for all of them, whatever their review-count and tox.
+
+    The configs are collected once, publishing the reports when done or,
+    if progressive, each time entries finish. With poll, every entry is
+    polled on its own schedule, forever.'''
+    # deferred import of scheduler until required
+    from . import scheduler
+    entries, config_entries = scheduler.get_shared_entries(
+        configs, PROVIDER_SECTIONS, poll_interval)
+    for entry in entries:
+        print(entry)
+    print("{} entries shared by {} configs".format(len(entries),
+                                                   len(configs)))
+    entry_scheduler = scheduler.Scheduler(
+        entries,
+        functools.partial(collect_entry, sessions=sessions, tox=tox,
+                          workers=workers, github_backend=github_backend,
+                          incremental=incremental),
+        functools.partial(publish_reports,
+                          reports=list(zip(config_entries,
+                                           output_directories)),
+                          sessions=sessions, tox=tox,
+                          render_mode=render_mode, tox_queue=tox_queue),
+        workers,
+        functools.partial(plan_entries, sessions=sessions,
+                          github_backend=github_backend,
+                          incremental=incremental))
+    if poll:
+        entry_scheduler.run_forever()
+    else:
+        entry_scheduler.run_once(progressive)
+
+
+def get_output_directories(config_files, output_directory):
+    '''Return the output directory of the report of each config file, a
+    sub-directory of output_directory named after the file.'''
+    names = [os.path.splitext(os.path.basename(config_file.name))[0]
+             for config_file in config_files]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise click.BadParameter(
+            "Config files must have different names, {} is used more than "
+            "once.".format(', '.join(duplicates)), param_hint="'--config'")
+    return [os.path.join(output_directory, name) for name in names]
+
+
+def aggregate_reviews(sources, output_directory, sessions, tox,
+                      github_backend='rest', incremental=False,
+                      progressive=False, render_mode='html',
+                      report_store=None, tox_queue=None, snapshot_path=None):
     try:
-        repos = []
-        if 'lp-git' in sources:
-            repos.extend(get_lp_repos(sources['lp-git'], output_directory,
-                                      lp_credentials_store))
-        if 'launchpad' in sources:
-            # install time dependency on launchpad libs.
-            from . import launchpadagent
-            repos.extend(get_branches(sources['launchpad'],
-                                      lp_credentials_store))
-        if 'github' in sources:
-            repos.extend(get_repos(sources['github'],
-                                   github_username, github_password, github_token))
+        publish = None
+        if progressive:
+            publish = functools.partial(render_partial,
+                                        output_directory=output_directory,
+                                        tox=tox, render_mode=render_mode,
+                                        report_store=report_store)
+        repos = collect_repos(sources, sessions, github_backend, incremental,
+                              publish)
+        if snapshot_path is not None:
+            save_report_snapshot(snapshot_path, repos)
         # Should we be running tox on any pull requests?
-        if tox:
-            tox_mps = []
-            # Are there any repos with any pull requests requiring a tox run?
-            for repo in repos:
-                if getattr(repo, 'pull_request_requiring_tox_count', 0) > 0:
-                    tox_mps.extend(repo.pull_requests_requiring_tox)
-
-            # For all pull requests requiring a tox run set the initial state
-            # as running, then render the report as normal.
-            for tox_mp in tox_mps:
-                parallel_tox = Parallel(n_jobs=-1)(
-                    delayed(tox_runner.prep_tox_state)(
-                        output_directory,
-                        tox_mp.web_link.split('/')[-1])
-                    for tox_mp in tox_mps
-                )
+        if tox_queue is not None:
+            # Queuing the pull requests requiring a tox run sets their state
+            # as running, then the report is rendered as normal while tox
+            # runs in the background and updates the state after each run
+            tox_queue.submit(get_tox_jobs(repos))
 
         # Render the report
-        render(repos, output_directory, tox)
-
-        if tox:
-            # Once report is rendered with initial state then we can start
-            # running the tox tests and update state after each run
-            parallel_tox = Parallel(n_jobs=-1)(
-                delayed(tox_runner.run_tox)(
-                    tox_mp.source_git_repository.display_name,
-                    _format_git_branch_name(tox_mp.source_git_path),
-                    output_directory,
-                    tox_mp.web_link.split('/')[-1])
-                for tox_mp in tox_mps
-            )
+        render(repos, output_directory, tox, sessions.github_scheduler,
+               render_mode=render_mode, report_store=report_store)
+
+        sessions.end_cycle()
+        publish_stats(output_directory, report_store)
 
         last_poll = format_datetime(pytz.utc.localize(datetime.datetime.utcnow()))
         print("Last run @ {}".format(last_poll))
@@ -567,13 +1317,17 @@ def aggregate_reviews(sources, output_directory, github_password, github_token,
 @click.command()
 @click.option('--config-skeleton', is_flag=True, default=False,
               help='Print example config.')
-@click.option('--config', required=True, type=click.File('r'),
+@click.option('--config', required=True, multiple=True, type=click.File('r'),
               help="Config yaml specifying which repositories/branches to "
-                   "query.{}".format(" When using the review-gator snap this"
+                   "query. May be given several times: the report of each "
+                   "config is then written to a sub-directory of the output "
+                   "directory named after the config file, and what the "
+                   "configs share is collected once for all of them.{}"
+                   .format(" When using the review-gator snap this"
                                      " config must reside under $HOME."
                                      if os.environ.get('SNAP', None) else ""),
               cls=clicklib.NotRequiredIf,
-              mutually_exclusive=['config_skeleton'])
+              mutually_exclusive=['config_skeleton', 'from_snapshot'])
 @click.option('--output-directory', envvar='REVIEW_GATOR_OUTPUT_DIRECTORY',
               required=False, type=click.Path(), default=lambda:
               os.environ.get('SNAP_USER_COMMON', "/tmp/review_gator/"),
@@ -598,23 +1352,139 @@ def aggregate_reviews(sources, output_directory, github_password, github_token,
                    "need to provide username and password. "
                    "You can also set GITHUB_TOKEN as an environment "
                    "variable.", default=None)
+@click.option('--github-concurrency', type=click.IntRange(min=1),
+              required=False, default=1,
+              help="Number of github repositories and pull request "
+                   "reviews/comments to fetch in parallel [default: 1]")
+@click.option('--github-backend', type=click.Choice(['rest', 'graphql']),
+              required=False, default='rest',
+              help="API used to collect github pull requests. The graphql "
+                   "backend batches repositories into a few queries and "
+                   "requires a github token. It always collects every open "
+                   "pull request: --incremental, and the planning of the "
+                   "REST rate limit with its fallback to the previous run, "
+                   "only apply to the rest backend. [default: rest]")
+@click.option('--github-graphql-url', envvar='GITHUB_GRAPHQL_URL',
+              required=False, default=None,
+              help="Github GraphQL endpoint, for Github Enterprise. "
+                   "You can also set GITHUB_GRAPHQL_URL as an environment "
+                   "variable. [default: https://api.github.com/graphql]")
+@click.option('--github-cache-size', type=click.IntRange(min=0),
+              required=False, default=100,
+              help="Size, in MB, of the on-disk cache of github responses "
+                   "that are revalidated with conditional requests. "
+                   "0 disables the cache. [default: 100]")
+@click.option('--incremental', is_flag=True, default=False,
+              help='Only fetch the github pull requests updated since the '
+                   'previous run, reusing the stored reviews of the others. '
+                   'Rest github backend only.')
+@click.option('--progressive', is_flag=True, default=False,
+              help='Publish a partial report each time the repositories of '
+                   'a config section have been collected, before the final '
+                   'report.')
+@click.option('--render-mode', type=click.Choice(['html', 'json']),
+              required=False, default='html',
+              help="Render the report table in html, or have the page load "
+                   "reviews.json and render it in the browser. The json mode "
+                   "needs the report to be served over http. [default: html]")
+@click.option('--serve', is_flag=True, default=False,
+              help='Serve the report over http from memory instead of '
+                   'writing reviews.html and reviews.json to the output '
+                   'directory. Keeps serving after the run unless polling.')
+@click.option('--serve-host', required=False, default='localhost',
+              help="Address to serve the report on. [default: localhost]")
+@click.option('--serve-port', type=click.IntRange(min=0), required=False,
+              default=8080,
+              help="Port to serve the report on. [default: 8080]")
 @click.option('--poll', is_flag=True, default=False,
-              help='Keep aggregating reviews at a specified interval')
+              help='Keep aggregating reviews, checking each repository, '
+                   'branch and owner at its own interval')
 @click.option('--tox', is_flag=True, default=False,
               help='If repo config "tox: true" run tox and show result '
                    'as graphic')
+@click.option('--tox-cache-ttl', type=click.IntRange(min=0), required=False,
+              default=168,
+              help="Hours a tox result is reused for a merge proposal whose "
+                   "source branch head has not changed [default: 168]")
+@click.option('--tox-cache-size', type=click.IntRange(min=0), required=False,
+              default=1000,
+              help="Number of tox results kept, the oldest being evicted "
+                   "first. 0 disables the tox result cache. [default: 1000]")
+@click.option('--tox-mirror-age', type=click.IntRange(min=1), required=False,
+              default=30,
+              help="Days the local git mirror of a tox source repository is "
+                   "kept after its last tox run [default: 30]")
+@click.option('--tox-mirror-size', type=click.IntRange(min=0), required=False,
+              default=2048,
+              help="Size, in MB, of the local git mirrors tox runs check "
+                   "merge proposals out from, the least recently used being "
+                   "evicted first. 0 disables the mirrors and clones each "
+                   "merge proposal instead. [default: 2048]")
+@click.option('--tox-workers', type=click.IntRange(min=1), required=False,
+              default=None,
+              help="Number of tox jobs run at the same time, in the "
+                   "background of the collection [default: the number of "
+                   "CPUs]")
+@click.option('--tox-timeout', type=click.IntRange(min=1), required=False,
+              default=60,
+              help="Minutes a tox job may run before it is killed and "
+                   "shown as failed [default: 60]")
 @click.option('--poll-interval', type=int, required=False, default=600,
-              help="Interval, in seconds, between each version check "
-                   "[default: 600 seconds]")
+              help="Interval, in seconds, between each version check of a "
+                   "repository, branch or owner, unless its config sets a "
+                   "poll-interval [default: 600 seconds]")
+@click.option('--poll-workers', type=click.IntRange(min=1), required=False,
+              default=4,
+              help="Number of repositories, branches and owners checked at "
+                   "the same time when polling [default: 4]")
+@click.option('--launchpad-concurrency', type=click.IntRange(min=1),
+              required=False, default=1,
+              help="Number of launchpad branches and merge proposals to "
+                   "fetch in parallel, each thread using its own launchpad "
+                   "session [default: 1]")
+@click.option('--launchpad-cache-size', type=click.IntRange(min=0),
+              required=False, default=100,
+              help="Size, in MB, of the on-disk cache of launchpad API "
+                   "representations, which are revalidated by ETag. The "
+                   "least recently used ones are evicted above this size. "
+                   "0 disables the size cap and statistics. [default: 100]")
+@click.option('--concurrency', type=click.IntRange(min=1), required=False,
+              default=None,
+              help="Total number of github and launchpad requests in flight "
+                   "at once, shared by the collectors of every provider, "
+                   "which run at the same time. [default: the github and "
+                   "launchpad concurrency of each]")
+@click.option('--save-snapshot', type=click.Path(dir_okay=False),
+              required=False, default=None,
+              help="Save the collected repositories, pull requests and "
+                   "reviews to this file after each run, for "
+                   "--from-snapshot. The file is gzipped if its name ends "
+                   "with .gz.")
+@click.option('--from-snapshot', type=click.Path(exists=True, dir_okay=False),
+              required=False, default=None,
+              help="Render the report, and run the reporters, from a file "
+                   "saved by --save-snapshot instead of collecting it. No "
+                   "credentials or network access are needed.")
+@click.option('--profile', is_flag=True, default=False,
+              help='Run a single aggregation, even with --poll, under '
+                   'cProfile and write the profile to {} in the output '
+                   'directory. Timings of each run are always written to {}.'
+                   .format(PROFILE_FILENAME, STATS_FILENAME))
 @click.option('--lp-credentials-store', envvar='LP_CREDENTIALS_STORE',
               required=False,
               help="An optional path to an already configured launchpad "
                    "credentials store.", default=None)
 def main(config_skeleton, config, output_directory,
-         github_username, github_password, github_token, poll,
-         tox, poll_interval, lp_credentials_store):
+         github_username, github_password, github_token, github_concurrency,
+         github_backend, github_graphql_url, github_cache_size, incremental,
+         progressive, render_mode, serve, serve_host, serve_port, poll, tox,
+         tox_cache_ttl, tox_cache_size, tox_mirror_age, tox_mirror_size,
+         tox_workers, tox_timeout, poll_interval, poll_workers,
+         launchpad_concurrency, launchpad_cache_size, concurrency,
+         save_snapshot, from_snapshot, profile, lp_credentials_store):
     """Start here."""
-    global NOW
+    github_cache_size *= 1024 * 1024
+    launchpad_cache_size *= 1024 * 1024
     if config_skeleton:
         with open(resource_filename(
                 'review_gator', 'config-skeleton.yaml'), 'r') as config_file:
@@ -625,26 +1495,120 @@ def main(config_skeleton, config, output_directory,
             print(output)
             exit(0)
 
-    sources = get_sources(config)
-    aggregate_reviews(sources, output_directory, github_password,
-                      github_token, github_username, tox, lp_credentials_store)
-
-    if poll:
-        # We do use time.sleep which is blocking so it is best to 'nice'
-        # the process to reduce CPU usage. https://linux.die.net/man/1/nice
+    configs = [get_sources(config_file) for config_file in config]
+    sources = configs[0] if configs else {}
+    output_directories = [output_directory]
+    if len(configs) > 1:
+        if serve or save_snapshot:
+            raise click.UsageError(
+                "--serve and --save-snapshot take a single --config")
+        output_directories = get_output_directories(config, output_directory)
+    sessions = api_sessions.Sessions(
+        github_username=github_username, github_password=github_password,
+        github_token=github_token, github_concurrency=github_concurrency,
+        github_cache_size=github_cache_size,
+        github_graphql_url=github_graphql_url,
+        lp_credentials_store=lp_credentials_store,
+        launchpad_concurrency=launchpad_concurrency,
+        launchpad_cache_size=launchpad_cache_size,
+        concurrency=concurrency,
+        snapshot_name=os.path.realpath(output_directory))
+    report_store = None
+    if serve:
+        # deferred import of server until required
+        from . import server
+        report_store = server.ReportStore()
+        report_server = server.start_server(report_store, output_directory,
+                                            serve_host, serve_port)
+        pending = [section for section in sources
+                   if section in PROVIDER_SECTIONS]
+        if pending:
+            # Answer with an empty report until the first one is rendered
+            render([], output_directory, tox, render_mode=render_mode,
+                   report_store=report_store, pending=pending)
+    if from_snapshot:
+        replay_snapshot(from_snapshot, output_directory, tox, render_mode,
+                        report_store)
+        # Send the metrics still queued for the reporters
+        reporters.flush()
+        if serve:
+            # Keep serving the report
+            report_server.thread.join()
+        return
+    tox_cache = None
+    if tox and tox_cache_size > 0:
+        tox_cache = tox_runner.ToxResultCache(
+            api_sessions.get_cache_dir('tox'), tox_cache_ttl * 60 * 60,
+            tox_cache_size)
+    tox_mirrors = None
+    if tox and tox_mirror_size > 0:
+        # deferred import of git_mirror until required
+        from . import git_mirror
+        tox_mirrors = git_mirror.GitMirrorCache(
+            api_sessions.get_cache_dir('git'), tox_mirror_age * 24 * 60 * 60,
+            tox_mirror_size * 1024 * 1024)
+    tox_queue = None
+    if tox:
+        tox_queue = tox_runner.ToxQueue(output_directories, tox_workers,
+                                        tox_timeout * 60, tox_cache,
+                                        tox_mirrors)
+    github_configs = [config_sources['github'] for config_sources in configs
+                      if 'github' in config_sources]
+    if github_configs:
+        # Forget the repositories dropped from the configs; the snapshot is
+        # only shared with processes writing to the same output directory
+        sessions.github_snapshot().prune(
+            [key for github_config in github_configs
+             for key in get_github_keys(github_config)])
+
+    if poll and not profile:
+        # The scheduler keeps the process running in the background so it
+        # is best to 'nice' the process to reduce CPU usage.
+        # https://linux.die.net/man/1/nice
         os.nice(19)
-        while True:
-            next_poll = format_datetime(
-                    pytz.utc.localize(
-                            datetime.datetime.utcnow() +
-                            datetime.timedelta(seconds=poll_interval)))
-            print("Next run @ {}".format(next_poll))
-            time.sleep(poll_interval)  # wait before checking again
-            NOW = pytz.utc.localize(datetime.datetime.utcnow())
-            aggregate_reviews(sources, output_directory, github_password,
-                              github_token, github_username, tox,
-                              lp_credentials_store)
-
+        if len(configs) > 1:
+            aggregate_configs(configs, output_directories, sessions, tox,
+                              poll_interval, poll_workers, github_backend,
+                              incremental, progressive, render_mode,
+                              tox_queue, poll=True)
+        else:
+            run_scheduler(sources, output_directory, sessions, tox,
+                          poll_interval, poll_workers, github_backend,
+                          incremental, render_mode, report_store, tox_queue,
+                          save_snapshot)
+    else:
+        if len(configs) > 1:
+            aggregate = aggregate_configs
+            args = (configs, output_directories, sessions, tox,
+                    poll_interval, poll_workers, github_backend, incremental,
+                    progressive, render_mode, tox_queue)
+        else:
+            aggregate = aggregate_reviews
+            args = (sources, output_directory, sessions, tox, github_backend,
+                    incremental, progressive, render_mode, report_store,
+                    tox_queue, save_snapshot)
+        if profile:
+            # deferred import of cProfile until required
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.runcall(aggregate, *args)
+            profile_path = os.path.join(output_directory, PROFILE_FILENAME)
+            profiler.dump_stats(profile_path)
+            print("**** {} written ****".format(profile_path))
+        else:
+            aggregate(*args)
+        # Send the metrics still queued for the reporters
+        reporters.flush()
+        if tox_queue is not None:
+            # Wait for the tox runs still in the background
+            tox_queue.join()
+        if tox_queue is not None or reporters.get_dispatcher() is not None:
+            # Add the time of the background work to the stats
+            for report_directory in output_directories:
+                publish_stats(report_directory, report_store)
+        if serve:
+            # Keep serving the report
+            report_server.thread.join()
 
 if __name__ == '__main__':
     sys.exit(main())
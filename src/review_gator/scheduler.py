@@ -0,0 +1,257 @@
+"""
+Poll each configured source on its own schedule.
+
+Every repository, branch and owner of the config is an entry polled at its
+own interval: the `poll-interval` of the entry in the config, in seconds,
+or the --poll-interval. Due entries are collected by a pool of worker
+threads and the report is published with the latest repos of every entry
+each time entries finish, so that a slow source does not hold back the
+others and busy sources can be polled more often than dormant ones.
+
+Several configs can share the entries of the sources they all configure,
+so that each is collected once for all of the reports.
+"""
+
+import concurrent.futures
+import copy
+import json
+import queue
+import time
+
+# Worker threads collecting entries
+DEFAULT_WORKERS = 4
+
+
+class Entry(object):
+    """A repository, branch or owner of the config and its latest repos.
+
+    sources is the config of the section of the entry, holding the entry
+    alone. repos is None until the entry has been collected, and tox_jobs
+    holds the tox runs the latest repos require."""
+
+    def __init__(self, section, kind, name, sources, interval):
+        self.section = section
+        self.kind = kind
+        self.name = name
+        self.sources = sources
+        self.interval = interval
+        self.next_run = 0
+        self.running = False
+        self.repos = None
+        self.tox_jobs = []
+
+    def __repr__(self):
+        return 'Entry[{}, {}, {}, every {}s]'.format(
+            self.section, self.kind, self.name, self.interval)
+
+
+def get_entry_sources(config, kind, items):
+    """Return the config of a section holding the given items of one kind,
+    and none of the other kinds."""
+    sources = dict((config_kind, {}) for config_kind in config)
+    sources[kind] = items
+    return sources
+
+
+def get_entries(sources, sections, poll_interval):
+    """Return an Entry for each repository, branch and owner of the given
+    sections of the config, in config order."""
+    entries = []
+    for section in sections:
+        config = sources[section]
+        for kind, items in config.items():
+            for name, data in items.items():
+                if section == 'github' and kind == 'repos':
+                    # github repositories are grouped by organisation
+                    for repo_name, repo_data in data.items():
+                        entries.append(Entry(
+                            section, kind, '{}/{}'.format(name, repo_name),
+                            get_entry_sources(
+                                config, kind, {name: {repo_name: repo_data}}),
+                            repo_data.get('poll-interval', poll_interval)))
+                    continue
+                entries.append(Entry(
+                    section, kind, name,
+                    get_entry_sources(config, kind, {name: data}),
+                    data.get('poll-interval', poll_interval)))
+    return entries
+
+
+def get_config_data(data):
+    """Return the config of an entry less its poll-interval."""
+    if not isinstance(data, dict):
+        return data
+    return dict((key, get_config_data(value)) for key, value in data.items()
+                if key != 'poll-interval')
+
+
+def get_entry_data(entry):
+    """Return the config of the item of an entry."""
+    items = entry.sources[entry.kind]
+    if entry.section == 'github' and entry.kind == 'repos':
+        org, name = entry.name.split('/', 1)
+        return items[org][name]
+    return items[entry.name]
+
+
+def get_entry_key(entry):
+    """Return the section, kind and name of an entry, as a key shared by the
+    entries of the same source.
+
+    Owners are swept for the branches modified within their max-age, so the
+    config of an owner, less its poll-interval, is part of its key."""
+    if entry.kind == 'owners':
+        return (entry.section, entry.kind, entry.name, json.dumps(
+            get_config_data(get_entry_data(entry)), sort_keys=True))
+    return (entry.section, entry.kind, entry.name)
+
+
+def share_entry(shared, entry):
+    """Collect the source of entry with the shared entry, which runs tox if
+    either asks for it and is polled at the shorter of their intervals."""
+    shared.interval = min(shared.interval, entry.interval)
+    data = get_entry_data(entry)
+    shared_data = get_entry_data(shared)
+    if data.get('tox') and not shared_data.get('tox'):
+        shared_data['tox'] = True
+    if 'review-count' in data:
+        shared_data['review-count'] = max(
+            shared_data.get('review-count', 0), data['review-count'])
+
+
+def get_shared_entries(configs, sections, poll_interval):
+    """Return the entries of several configs, and the entries of each
+    config.
+
+    The entries of the same source, such as a repository configured by
+    several configs, are shared by them and collected once, polled at the
+    shortest of their intervals. The entries of each config are returned as
+    a dict of the config of each of them, less its poll-interval, in config
+    order, so that the review-count and tox of each config are applied to
+    the repos it shows."""
+    entries = []
+    shared = {}
+    config_entries = []
+    for sources in configs:
+        own = {}
+        for entry in get_entries(sources, [section for section in sources
+                                           if section in sections],
+                                 poll_interval):
+            key = get_entry_key(entry)
+            data = get_config_data(get_entry_data(entry))
+            if key in shared:
+                share_entry(shared[key], entry)
+                entry = shared[key]
+            else:
+                # The shared entry may collect more than this config asks
+                entry.sources = copy.deepcopy(entry.sources)
+                shared[key] = entry
+                entries.append(entry)
+            own[entry] = data
+        config_entries.append(own)
+    return entries, config_entries
+
+
+class Scheduler(object):
+    """Collect entries when they are due on a pool of worker threads.
+
+    collect(entry) returns the repos of an entry. publish(entries,
+    finished) is called from the scheduling thread with all of the entries
+    and those that were just collected, once for any entries finishing
+    together. prepare(due), if given, is called from the scheduling thread
+    with the entries due together, before they start."""
+
+    def __init__(self, entries, collect, publish, workers=DEFAULT_WORKERS,
+                 prepare=None):
+        self.entries = entries
+        self.collect = collect
+        self.publish = publish
+        self.prepare = prepare
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers)
+        self._finished = queue.Queue()
+
+    def submit_all(self, due):
+        """Start collecting the entries due together."""
+        if due and self.prepare is not None:
+            try:
+                self.prepare(due)
+            except Exception as e:
+                # Each entry is still collected on its own
+                print("*** Preparing {} entries failed: {} ***".format(
+                    len(due), e))
+        for entry in due:
+            self.submit(entry)
+
+    def submit(self, entry):
+        """Start collecting an entry."""
+        entry.running = True
+        future = self.executor.submit(self.collect, entry)
+        future.add_done_callback(
+            lambda future: self._finished.put((entry, future)))
+
+    def next_timeout(self):
+        """Return the seconds until the next idle entry is due, or None if
+        every entry is being collected."""
+        due = [entry.next_run for entry in self.entries if not entry.running]
+        if not due:
+            return None
+        return max(0, min(due) - time.time())
+
+    def run_pending(self):
+        """Start collecting the idle entries that are due."""
+        now = time.time()
+        self.submit_all([entry for entry in self.entries
+                         if not entry.running and entry.next_run <= now])
+
+    def wait(self, timeout=None):
+        """Wait up to timeout seconds for entries to finish, then record
+        their repos and publish them."""
+        finished = self.finish(timeout)
+        if finished is not None:
+            self.publish(self.entries, finished)
+
+    def finish(self, timeout=None):
+        """Wait up to timeout seconds for entries to finish and record
+        their repos. Returns the entries collected, or None if none
+        finished in time."""
+        try:
+            results = [self._finished.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+        while True:
+            try:
+                results.append(self._finished.get_nowait())
+            except queue.Empty:
+                break
+        finished = []
+        for entry, future in results:
+            entry.running = False
+            entry.next_run = time.time() + entry.interval
+            try:
+                entry.repos = future.result()
+            except Exception as e:
+                # The entry keeps its previous repos until its next run
+                print("*** Collecting {} failed, retrying in {}s: {} "
+                      "***".format(entry, entry.interval, e))
+                continue
+            finished.append(entry)
+        return finished
+
+    def run_once(self, progressive=False):
+        """Collect every entry once, then publish them together or, if
+        progressive, each time entries finish."""
+        self.submit_all(self.entries)
+        finished = []
+        while any(entry.running for entry in self.entries):
+            finished.extend(self.finish())
+            if progressive and any(entry.running for entry in self.entries):
+                self.publish(self.entries, finished)
+                finished = []
+        self.publish(self.entries, finished)
+
+    def run_forever(self):
+        """Keep collecting entries as they become due."""
+        while True:
+            self.run_pending()
+            self.wait(self.next_timeout())
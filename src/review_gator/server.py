@@ -0,0 +1,165 @@
+"""
+Serve the latest report from memory.
+
+Rendered reports are published to a ReportStore instead of the output
+directory. An http server, running in its own threads so that it answers
+while a collection runs, serves the stored documents with ETag, gzip and
+Cache-Control support. The vendored assets are served from the store too,
+and any other file, such as the tox state SVGs, from the output directory.
+"""
+
+import gzip
+import hashlib
+import http.server
+import mimetypes
+import os
+import threading
+import urllib.parse
+
+from . import publisher
+
+# Cache-Control of the report and its data, which change every cycle
+REVALIDATE = 'no-cache'
+# Cache-Control of the hashed vendored assets, which never change
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Smallest body worth compressing
+GZIP_MIN_SIZE = 1024
+INDEX = 'reviews.html'
+
+
+class Document(object):
+    """A document served from memory, along with its gzipped body."""
+
+    def __init__(self, body, content_type, cache_control=REVALIDATE):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha1(body).hexdigest()
+        self.gzipped = None
+        if len(body) >= GZIP_MIN_SIZE:
+            self.gzipped = gzip.compress(body)
+
+    def etag(self, gzipped=False):
+        """Return the entity tag of the plain or gzipped body."""
+        if gzipped:
+            return '"{}-gzip"'.format(self.digest)
+        return '"{}"'.format(self.digest)
+
+
+class ReportStore(object):
+    """The documents served, by path."""
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+        self.assets = self.publish_assets()
+
+    def publish(self, path, body, content_type=None,
+                cache_control=REVALIDATE):
+        """Serve body at path, replacing any previous document."""
+        if content_type is None:
+            content_type = mimetypes.guess_type(path)[0] or \
+                'application/octet-stream'
+        document = Document(body, content_type, cache_control)
+        with self._lock:
+            self._documents[path] = document
+
+    def get(self, path):
+        """Return the document at path, or None."""
+        with self._lock:
+            return self._documents.get(path)
+
+    def publish_assets(self):
+        """Serve the vendored assets and return the url of each top level
+        asset by name."""
+        for relative_path, url in publisher.get_vendor_urls().items():
+            with open(os.path.join(publisher.VENDOR_PATH,
+                                   relative_path), 'rb') as f:
+                body = f.read()
+            cache_control = IMMUTABLE
+            if os.path.dirname(relative_path):
+                cache_control = REVALIDATE
+            self.publish(url, body, cache_control=cache_control)
+        return publisher.get_assets()
+
+
+class ReportRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the documents of the store of the server, falling back to the
+    files of its output directory."""
+
+    def do_GET(self):
+        self.send_document(head=False)
+
+    def do_HEAD(self):
+        self.send_document(head=True)
+
+    def log_request(self, code='-', size='-'):
+        # Requests are too frequent to log; errors are still logged
+        pass
+
+    def get_document(self, path):
+        document = self.server.store.get(path)
+        if document is not None:
+            return document
+        root = os.path.realpath(self.server.output_directory)
+        file_path = os.path.realpath(os.path.join(root, path))
+        if not file_path.startswith(root + os.sep) or \
+                not os.path.isfile(file_path):
+            return None
+        with open(file_path, 'rb') as f:
+            return Document(f.read(), mimetypes.guess_type(file_path)[0] or
+                            'application/octet-stream')
+
+    def send_document(self, head):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        path = path.lstrip('/') or INDEX
+        document = self.get_document(path)
+        if document is None:
+            self.send_error(404)
+            return
+        accepted = self.headers.get('Accept-Encoding', '')
+        use_gzip = document.gzipped is not None and 'gzip' in accepted
+        etag = document.etag(use_gzip)
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', document.cache_control)
+            self.end_headers()
+            return
+        body = document.gzipped if use_gzip else document.body
+        self.send_response(200)
+        self.send_header('Content-Type', document.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', document.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+
+class ReportServer(http.server.ThreadingHTTPServer):
+    """An http server of a ReportStore."""
+
+    daemon_threads = True
+
+    def __init__(self, address, store, output_directory):
+        super(ReportServer, self).__init__(address, ReportRequestHandler)
+        self.store = store
+        self.output_directory = output_directory
+
+
+def start_server(store, output_directory, host='localhost', port=8080):
+    """Serve store from a background thread and return the server; its
+    thread attribute holds that thread."""
+    server = ReportServer((host, port), store, output_directory)
+    server.thread = threading.Thread(target=server.serve_forever,
+                                     name='review-gator-server')
+    server.thread.daemon = True
+    server.thread.start()
+    print("**** Serving http://{}:{}/ ****".format(*server.server_address))
+    return server
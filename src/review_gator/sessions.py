@@ -0,0 +1,220 @@
+"""
+API client sessions shared by every aggregate_reviews run.
+
+The github client, the github GraphQL client and the pool of launchpad
+sessions are created on first use and then kept, along with their pools
+of keep-alive connections, for the life of the process. A client is only
+logged in again after a request fails authentication.
+"""
+
+import contextlib
+import hashlib
+import os
+import threading
+
+import requests
+
+from . import githubagent
+from . import http_cache
+from . import instrumentation
+
+GITHUB = 'github'
+LAUNCHPAD = 'launchpad'
+
+
+def get_cache_dir(name):
+    """Return the directory for the named cache."""
+    cachedir_prefix = os.environ.get('SNAP_USER_COMMON', "/tmp")
+    return os.path.join(cachedir_prefix, 'get_reviews', name)
+
+
+class RequestSlots(object):
+    """A budget of API requests in flight at once, shared by the clients of
+    every provider.
+
+    A slot is held by a thread for the length of a request. Slots are
+    re-entrant within a thread, as a request may follow a redirect through
+    another request."""
+
+    def __init__(self, count):
+        self._semaphore = threading.BoundedSemaphore(count)
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold a slot for the body of the with statement."""
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._semaphore.acquire()
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self._semaphore.release()
+
+
+class Sessions(object):
+    """Long-lived API clients for each provider.
+
+    With a global concurrency, the clients share RequestSlots so that no
+    more than concurrency requests are in flight at once across all of the
+    providers."""
+
+    def __init__(self, github_username=None, github_password=None,
+                 github_token=None, github_concurrency=1,
+                 github_cache_size=http_cache.DEFAULT_MAX_SIZE,
+                 github_graphql_url=None, lp_credentials_store=None,
+                 launchpad_concurrency=1,
+                 launchpad_cache_size=http_cache.DEFAULT_MAX_SIZE,
+                 concurrency=None, snapshot_name=None):
+        self.github_username = github_username
+        self.github_password = github_password
+        self.github_token = github_token
+        self.github_concurrency = github_concurrency
+        self.github_cache_size = github_cache_size
+        self.github_graphql_url = github_graphql_url
+        self.lp_credentials_store = lp_credentials_store
+        self.launchpad_concurrency = launchpad_concurrency
+        self.launchpad_cache_size = launchpad_cache_size
+        self.concurrency = concurrency
+        self.slots = None
+        if concurrency is not None:
+            self.slots = RequestSlots(concurrency)
+        self.snapshot_name = snapshot_name
+        self.github_cache = None
+        # The RateLimitScheduler of the current github rate limit window
+        self.github_scheduler = None
+        self._github_scheduler_lock = threading.Lock()
+        self._github = None
+        self._github_graphql = None
+        self._github_snapshot = None
+        self._launchpad = None
+
+    def github(self):
+        """Return the github client, or None without github credentials."""
+        if self._github is None:
+            if self.github_cache is None and self.github_cache_size > 0:
+                self.github_cache = http_cache.ResponseCache(
+                    get_cache_dir('github'), self.github_cache_size)
+            self._github = githubagent.get_github(
+                self.github_username, self.github_password,
+                self.github_token,
+                pool_size=max(self.github_concurrency, self.concurrency or 0),
+                cache=self.github_cache, slots=self.slots)
+        return self._github
+
+    def github_graphql(self):
+        """Return the github GraphQL client, or None without a token."""
+        if self._github_graphql is None and self.github_token:
+            # deferred import of github_graphql until required
+            from . import github_graphql
+            self._github_graphql = github_graphql.GraphQLClient(
+                self.github_token,
+                self.github_graphql_url or github_graphql.GRAPHQL_URL,
+                slots=self.slots)
+        return self._github_graphql
+
+    def github_rate_limit(self):
+        """Return the RateLimitScheduler shared by the github collections
+        until the rate limit resets, or None without github credentials."""
+        gh = self.github()
+        if gh is None:
+            return None
+        with self._github_scheduler_lock:
+            if self.github_scheduler is None or \
+                    not self.github_scheduler.in_window(gh):
+                # deferred import of ratelimit until required
+                from . import ratelimit
+                self.github_scheduler = ratelimit.RateLimitScheduler(gh)
+            else:
+                self.github_scheduler.refresh()
+            return self.github_scheduler
+
+    def github_snapshot(self):
+        """Return the snapshot of the collected github pull requests.
+
+        Processes given a different snapshot_name, such as their output
+        directory, keep separate snapshots, each holding the repos of its
+        own config."""
+        if self._github_snapshot is None:
+            # deferred import of snapshot until required
+            from . import snapshot
+            filename = 'github.json'
+            if self.snapshot_name is not None:
+                filename = 'github-{}.json'.format(hashlib.sha1(
+                    self.snapshot_name.encode('utf-8')).hexdigest())
+            self._github_snapshot = snapshot.GithubSnapshot(
+                os.path.join(get_cache_dir('snapshots'), filename))
+        return self._github_snapshot
+
+    def launchpad(self):
+        """Return the pool of launchpad sessions."""
+        if self._launchpad is None:
+            # deferred import of launchpadagent until required
+            from . import launchpadagent
+            self._launchpad = launchpadagent.LaunchpadSessions(
+                launchpadlib_dir=get_cache_dir('.launchpadlib'),
+                lp_credentials_store=self.lp_credentials_store,
+                cache_size=self.launchpad_cache_size, slots=self.slots)
+        return self._launchpad
+
+    def budget(self, provider):
+        """Return the number of worker threads of a provider section.
+
+        Without a global concurrency each section uses the concurrency of
+        its provider. Otherwise every section may use the whole budget, the
+        requests of all of the sections waiting for the shared slots."""
+        if self.concurrency is None:
+            if provider == GITHUB:
+                return self.github_concurrency
+            return self.launchpad_concurrency
+        return self.concurrency
+
+    def reset(self, provider):
+        """Drop the clients of a provider so that they log in again."""
+        if provider == GITHUB:
+            self._github = None
+            self._github_graphql = None
+        elif provider == LAUNCHPAD and self._launchpad is not None:
+            self._launchpad.reset()
+
+    def is_auth_failure(self, provider, error):
+        """True if error is an authentication failure of provider."""
+        if provider == GITHUB:
+            import github
+            if isinstance(error, github.BadCredentialsException):
+                return True
+            return (isinstance(error, requests.HTTPError) and
+                    error.response is not None and
+                    error.response.status_code == 401)
+        if provider == LAUNCHPAD:
+            from lazr.restfulclient.errors import Unauthorized
+            return isinstance(error, Unauthorized)
+        return False
+
+    def call(self, provider, func, *args, **kwargs):
+        """Call func, logging in again and retrying once when a request of
+        provider fails authentication."""
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not self.is_auth_failure(provider, e):
+                raise
+            print("*** {} authentication failed, logging in again: "
+                  "{} ***".format(provider, e))
+            self.reset(provider)
+            return func(*args, **kwargs)
+
+    def end_cycle(self):
+        """Persist and report the caches at the end of a run."""
+        stats = instrumentation.get_stats()
+        if self.github_cache is not None:
+            self.github_cache.save()
+            print("github cache: {}".format(self.github_cache.stats))
+            stats.record_cache('github', self.github_cache.stats)
+        if self._launchpad is not None and self.launchpad_cache_size:
+            self._launchpad.prune()
+            print("launchpad cache: {}".format(self._launchpad.stats))
+            stats.record_cache('launchpad', self._launchpad.stats)
@@ -0,0 +1,271 @@
+"""
+Persistent snapshots of collected pull requests.
+
+A snapshot keeps the reviews and latest activity computed for each github
+pull request, along with the date the pull request was last updated, so
+that a later run only needs to fetch the pull requests updated since.
+
+A report snapshot keeps every repository, pull request and review of a
+report, from any provider, so that the report can be rendered again
+without collecting it.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+import pytz
+
+from . import publisher
+from .review_gator import (GithubPullRequest, GithubRepo, GithubReview,
+                           LaunchpadPullRequest, LaunchpadRepo,
+                           LaunchpadReview, to_utc)
+
+SNAPSHOT_VERSION = 3
+REPORT_SNAPSHOT_VERSION = 2
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# The dates of the github snapshot keep their utc offset
+AWARE_DATE_FORMAT = DATE_FORMAT + '%z'
+
+
+def format_date(date):
+    """Return date as a naive utc string."""
+    if date is None:
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(pytz.utc).replace(tzinfo=None)
+    return date.strftime(DATE_FORMAT)
+
+
+def parse_date(value):
+    """Return the naive utc datetime of a string from format_date."""
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value, DATE_FORMAT)
+
+
+def parse_utc_date(value):
+    """Return the utc datetime of a string from format_date."""
+    date = parse_date(value)
+    if date is None:
+        return None
+    return pytz.utc.localize(date)
+
+
+def format_aware_date(date):
+    """Return a github date, naive utc or timezone aware, as a utc string
+    with its offset."""
+    if date is None:
+        return None
+    return to_utc(date).strftime(AWARE_DATE_FORMAT)
+
+
+def parse_aware_date(value):
+    """Return the utc datetime of a string from format_aware_date."""
+    if value is None:
+        return None
+    return datetime.datetime.strptime(
+        value, AWARE_DATE_FORMAT).astimezone(pytz.utc)
+
+
+class GithubSnapshot(object):
+    """The github pull requests collected by a previous run.
+
+    Repositories are keyed by their 'org/name' and pull requests by their
+    number. Each repository also records the most recent update date of its
+    pull requests, which is the date changes are looked for after. Dates
+    are stored, and returned, in utc with their timezone. A snapshot can be
+    shared by threads collecting different repositories."""
+
+    def __init__(self, path):
+        self.path = path
+        self.repos = {}
+        self._lock = threading.RLock()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        if data.get('version') == SNAPSHOT_VERSION:
+            self.repos = data['repos']
+
+    def __contains__(self, name):
+        return name in self.repos
+
+    def updated_at(self, name):
+        """Return the utc date of the last update seen for a repo."""
+        entry = self.repos.get(name)
+        if entry is None:
+            return None
+        return parse_aware_date(entry['updated_at'])
+
+    def pull_request_count(self, name):
+        """Return the number of open pull requests stored for a repo."""
+        entry = self.repos.get(name, {'pull_requests': {}})
+        return len(entry['pull_requests'])
+
+    def get_repo(self, name, review_count):
+        """Return a GithubRepo holding the stored pull requests of a repo, or
+        None if the repo has not been collected."""
+        entry = self.repos.get(name)
+        if entry is None:
+            return None
+        gr = GithubRepo(entry['url'], entry['ssh_url'])
+        pull_requests = [pr for _, pr in self.get_prs(name, review_count)]
+        pull_requests.sort(key=lambda pr: pr.date, reverse=True)
+        for pr in pull_requests:
+            gr.add(pr)
+        return gr
+
+    def get_prs(self, name, review_count):
+        """Return (number, GithubPullRequest) for each stored pull request."""
+        with self._lock:
+            entry = self.repos.get(name, {'pull_requests': {}})
+            stored = list(entry['pull_requests'].items())
+        pull_requests = []
+        for number, data in stored:
+            pr = GithubPullRequest(data['url'], data['title'],
+                                   data['owner'], data['state'],
+                                   parse_aware_date(data['date']),
+                                   review_count)
+            for review in data['reviews']:
+                pr.add_review(GithubReview(
+                    review['url'], review['owner'], review['state'],
+                    parse_aware_date(review['date'])))
+            pr.latest_activity = parse_aware_date(data['latest_activity'])
+            pull_requests.append((int(number), pr))
+        return pull_requests
+
+    def update(self, name, gr, pulls, pull_requests, complete):
+        """Record the pulls listed for a repo, held by the GithubRepo gr, and
+        the open pull requests built from them.
+
+        pull_requests holds a (GithubPullRequest, pull) tuple per open
+        pull. Closed pulls are dropped from the snapshot; when complete is
+        True the pulls are all of the open pull requests of the repo and
+        replace the stored ones."""
+        with self._lock:
+            self._update(name, gr, pulls, pull_requests, complete)
+
+    def _update(self, name, gr, pulls, pull_requests, complete):
+        entry = self.repos.setdefault(
+            name, {'updated_at': None, 'pull_requests': {}})
+        entry['url'] = gr.url
+        entry['ssh_url'] = gr.name
+        stored = entry['pull_requests']
+        if complete:
+            stored.clear()
+        for p in pulls:
+            stored.pop(str(p.number), None)
+        for pr, p in pull_requests:
+            stored[str(p.number)] = {
+                'url': pr.url,
+                'title': pr.title,
+                'owner': pr.owner,
+                'state': pr.state,
+                'date': format_aware_date(pr.date),
+                'latest_activity': format_aware_date(pr.latest_activity),
+                'reviews': [{
+                    'url': review.url,
+                    'owner': review.owner,
+                    'state': review.state,
+                    'date': format_aware_date(review.date),
+                } for review in pr.reviews],
+            }
+        if pulls:
+            updated_at = max(to_utc(p.updated_at) for p in pulls)
+            if complete or updated_at > self.updated_at(name):
+                entry['updated_at'] = format_aware_date(updated_at)
+
+    def prune(self, names):
+        """Forget the repos that are not in names."""
+        with self._lock:
+            for name in set(self.repos) - set(names):
+                del self.repos[name]
+
+    def save(self):
+        """Write the snapshot to disk."""
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f, self._lock:
+            json.dump({'version': SNAPSHOT_VERSION, 'repos': self.repos}, f)
+        os.replace(tmp_path, self.path)
+
+
+def save_report(path, repos, generated):
+    """Write the repos of a report generated at the given date to path,
+    gzipped if path ends with .gz."""
+    data = {
+        'version': REPORT_SNAPSHOT_VERSION,
+        'generated': format_date(generated),
+        'repos': [{
+            'type': repo.repo_type,
+            'url': repo.url,
+            'name': repo.name,
+            'tox': repo.tox,
+            'pull_requests': [{
+                'url': pr.url,
+                'title': pr.title,
+                'owner': pr.owner,
+                'state': pr.state,
+                'date': format_date(pr.date),
+                'latest_activity': format_date(pr.latest_activity),
+                'review_count': pr.review_count,
+                'source': pr.source,
+                'target': pr.target,
+                'reviews': [[review.url, review.owner, review.state,
+                             format_date(review.date)]
+                            for review in pr.reviews],
+            } for pr in repo.pull_requests],
+        } for repo in repos],
+    }
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if path.endswith('.gz'):
+        body = gzip.compress(body)
+    publisher.write_file(path, body)
+
+
+def load_report(path):
+    """Return the repos and generation date of a report saved by
+    save_report. Raises ValueError if the file is not a report snapshot of
+    this version."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        data = json.load(f)
+    if data.get('version') != REPORT_SNAPSHOT_VERSION:
+        raise ValueError('{} is not a version {} report snapshot'.format(
+            path, REPORT_SNAPSHOT_VERSION))
+    repos = []
+    for repo_data in data['repos']:
+        if repo_data['type'] == 'github':
+            repo = GithubRepo(repo_data['url'], repo_data['name'])
+        else:
+            repo = LaunchpadRepo(repo_data['url'], repo_data['name'])
+        repo.tox = repo_data['tox']
+        for pr_data in repo_data['pull_requests']:
+            repo.add(get_report_pr(repo_data['type'], pr_data))
+        repos.append(repo)
+    return repos, pytz.utc.localize(parse_date(data['generated']))
+
+
+def get_report_pr(repo_type, data):
+    """Return the pull request, with its reviews, of a report snapshot."""
+    # Github pull requests and reviews localize their naive utc dates
+    if repo_type == 'github':
+        pr_cls, review_cls, to_date = \
+            GithubPullRequest, GithubReview, parse_date
+    else:
+        pr_cls, review_cls, to_date = \
+            LaunchpadPullRequest, LaunchpadReview, parse_utc_date
+    pr = pr_cls(data['url'], data['title'], data['owner'],
+                data['state'], to_date(data['date']), data['review_count'])
+    if repo_type != 'github':
+        pr.source, pr.target = data['source'], data['target']
+    for url, owner, state, date in data['reviews']:
+        pr.add_review(review_cls(url, owner, state, to_date(date)))
+    pr.latest_activity = parse_utc_date(data['latest_activity'])
+    return pr
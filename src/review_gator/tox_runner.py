@@ -1,10 +1,120 @@
 #!/usr/bin/env python
 
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
-import shutil
+import queue
+import signal
+import tempfile
+import threading
+import time
 
 import git
 from lpmptox import runtox as lpmptox_runtox
+# lpmptox is shipped by lpshipit, pinned in requirements.txt as tox is run
+# in a mirror worktree through this private function
+from lpmptox import _run_tox_locally
+
+from . import instrumentation
+from . import publisher
+
+# Seconds a tox result is reused for
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+DEFAULT_CACHE_ENTRIES = 1000
+# Seconds to wait for the head commit of a branch
+LS_REMOTE_TIMEOUT = 60
+# Command run in the checkout of a merge proposal, as lpmptox runs it
+TOX_COMMAND = 'tox --recreate --parallel auto'
+# Seconds a tox job may run before it is killed and marked as failed
+DEFAULT_JOB_TIMEOUT = 60 * 60
+
+# The arguments of a tox run of a merge proposal, when the merge proposal
+# was last updated, as an epoch, and the head commit of its source branch as
+# last seen by launchpad, or None
+ToxJob = collections.namedtuple(
+    'ToxJob', ['source_repo', 'source_branch', 'mp_id', 'updated', 'commit'])
+
+
+class ToxResultCache(object):
+    """Tox results by source repository and head commit.
+
+    Each result is a file of directory named by the hash of its key, whose
+    modification time is when the result was recorded, so that tox runs in
+    other processes can share the cache. Results older than ttl seconds are
+    ignored and the oldest results are evicted above max_entries."""
+
+    def __init__(self, directory, ttl=DEFAULT_CACHE_TTL,
+                 max_entries=DEFAULT_CACHE_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _path(self, source_repo, commit):
+        key = '{}\n{}'.format(source_repo, commit).encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest())
+
+    def get(self, source_repo, commit):
+        """Return True or False if tox passed or failed on the commit of
+        source_repo, or None if there is no fresh result."""
+        path = self._path(source_repo, commit)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)['passed']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def store(self, source_repo, commit, passed):
+        """Record the tox result of the commit of source_repo."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'source_repo': source_repo, 'commit': commit,
+                       'passed': passed}, f)
+        os.replace(tmp_path, self._path(source_repo, commit))
+        self.prune()
+
+    def prune(self):
+        """Remove the expired results and the oldest ones above
+        max_entries."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        expired = time.time() - self.ttl
+        for index, (mtime, path) in enumerate(entries):
+            if index >= self.max_entries or mtime < expired:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def get_head_commit(source_repo, source_branch):
+    """Return the head commit of a branch of a remote repository, or None if
+    it cannot be found."""
+    try:
+        output = git.cmd.Git().ls_remote(
+            source_repo, 'refs/heads/{}'.format(source_branch),
+            kill_after_timeout=LS_REMOTE_TIMEOUT)
+    except git.exc.GitCommandError as git_exc:
+        print("** Could not find the head of repo {} branch {} **".format(
+            source_repo, source_branch))
+        print(git_exc)
+        return None
+    if not output:
+        return None
+    return output.split()[0]
 
 
 def prep_tox_state(output_directory=None, mp_id=None):
@@ -13,19 +123,47 @@ def prep_tox_state(output_directory=None, mp_id=None):
         os.path.realpath(__file__)), "vendor")
     tox_state = os.path.join(output_directory, "{}.svg".format(mp_id))
     clock_svg = os.path.join(abs_vendor_path, "clock.svg")
-    shutil.copy(clock_svg, tox_state)
+    publisher.copy_file(clock_svg, tox_state)
 
 
-def run_tox(source_repo, source_branch, output_directory=None, mp_id=None):
+def run_tox(source_repo, source_branch, output_directory=None, mp_id=None,
+            cache=None, mirrors=None):
     abs_vendor_path = os.path.join(os.path.dirname(
         os.path.realpath(__file__)), "vendor")
     tox_state = os.path.join(output_directory, "{}.svg".format(mp_id))
     clock_svg = os.path.join(abs_vendor_path, "clock.svg")
     error_svg = os.path.join(abs_vendor_path, "error.svg")
     success_svg = os.path.join(abs_vendor_path, "success.svg")
-    shutil.copy(clock_svg, tox_state)
+    commit = None
+    if mirrors is not None:
+        # Updating the mirror gives the head commit of the branch
+        try:
+            commit = mirrors.fetch(source_repo, source_branch)
+        except git.exc.GitCommandError as git_exc:
+            print("** Could not update the mirror of repo {} branch {}, "
+                  "cloning it instead **".format(source_repo, source_branch))
+            print(git_exc)
+    elif cache is not None:
+        commit = get_head_commit(source_repo, source_branch)
+    if cache is not None:
+        # A branch whose head has already been tested is not run again
+        passed = cache.get(source_repo, commit) if commit else None
+        if passed is not None:
+            print("{} (cached) for repo {} branch {} at {}".format(
+                "PASS" if passed else "FAIL", source_repo, source_branch,
+                commit))
+            publisher.copy_file(success_svg if passed else error_svg,
+                                tox_state)
+            return
+    publisher.copy_file(clock_svg, tox_state)
     try:
-        tox_return_code = lpmptox_runtox(source_repo, source_branch)
+        if mirrors is not None and commit is not None:
+            with mirrors.worktree(source_repo, commit) as local_repo, \
+                    open(os.devnull, 'a') as output_file:
+                tox_return_code = _run_tox_locally(local_repo, TOX_COMMAND,
+                                                   output_file)
+        else:
+            tox_return_code = lpmptox_runtox(source_repo, source_branch)
     except git.exc.GitCommandError as git_exc:
         # If there was a git exception it should not exit as run_tox is
         # called as a parallel set of jobs and one job failing should not
@@ -33,10 +171,172 @@ def run_tox(source_repo, source_branch, output_directory=None, mp_id=None):
         print("** There was an exception running git commands for repo "
               "{} branch {} **".format(source_repo, source_branch))
         print(git_exc)
+        # Not a result of the commit, so it is not cached
+        commit = None
         tox_return_code = 1
     if tox_return_code == 0:
         print("PASS for repo {} branch {}".format(source_repo, source_branch))
-        shutil.copy(success_svg, tox_state)
+        publisher.copy_file(success_svg, tox_state)
     else:
         print("FAIL for repo {} branch {}".format(source_repo, source_branch))
-        shutil.copy(error_svg, tox_state)
+        publisher.copy_file(error_svg, tox_state)
+    if commit is not None and cache is not None:
+        cache.store(source_repo, commit, tox_return_code == 0)
+
+
+def run_tox_job(source_repo, source_branch, output_directory, mp_id, cache,
+                mirrors):
+    """Run tox in a process group of its own, so that the tox job and all of
+    its children can be killed together."""
+    os.setsid()
+    run_tox(source_repo, source_branch, output_directory, mp_id, cache,
+            mirrors)
+
+
+class ToxQueue(object):
+    """Run tox jobs in the background on a pool of worker threads.
+
+    The queue outlives the collection that submitted its jobs, so that the
+    next collection can start while tox is still running. Jobs of the most
+    recently updated merge proposals run first. A merge proposal already
+    queued or running at the same commit is not queued again; a job for a
+    new commit supersedes the queued job of the merge proposal, and waits
+    for its running job to finish. Each job runs in a process of its own,
+    which is killed, and the job marked as failed, after timeout seconds.
+    Tox results are reused from cache and source repositories checked out
+    from the git_mirror.GitMirrorCache mirrors, when given.
+
+    The tox state of each job is shown in the first of output_directories
+    as it runs, and copied to the other reports once it finishes."""
+
+    def __init__(self, output_directories, workers=None,
+                 timeout=DEFAULT_JOB_TIMEOUT, cache=None, mirrors=None):
+        self.output_directory = output_directories[0]
+        self.copy_directories = output_directories[1:]
+        self.timeout = timeout
+        self.cache = cache
+        self.mirrors = mirrors
+        self._queue = queue.PriorityQueue()
+        # (mp_id, commit) of the jobs queued or running
+        self._jobs = set()
+        # The (mp_id, commit) of the latest job of each merge proposal
+        self._latest = {}
+        # Merge proposals running, and the job of each waiting for it
+        self._running = set()
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        # Forking a process with running threads is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        for index in range(workers or os.cpu_count() or 1):
+            thread = threading.Thread(target=self._work,
+                                      name='tox-worker-{}'.format(index))
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, jobs):
+        """Queue the ToxJobs of the merge proposals not already queued or
+        running at the same commit, setting their tox state to running."""
+        for job in jobs:
+            key = (job.mp_id, job.commit)
+            with self._lock:
+                if key in self._jobs:
+                    continue
+                self._jobs.add(key)
+                self._latest[job.mp_id] = key
+            prep_tox_state(self.output_directory, job.mp_id)
+            for output_directory in self.copy_directories:
+                prep_tox_state(output_directory, job.mp_id)
+            self._queue.put((-job.updated, next(self._order), job))
+
+    def join(self):
+        """Wait for every queued job to finish."""
+        self._queue.join()
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            key = (job.mp_id, job.commit)
+            with self._lock:
+                if self._latest.get(job.mp_id) != key:
+                    # Superseded by the job of a newer commit
+                    self._jobs.discard(key)
+                    self._queue.task_done()
+                    continue
+                if job.mp_id in self._running:
+                    # Queued again once the running job of the merge
+                    # proposal finishes, superseding any job waiting already
+                    superseded = self._waiting.get(job.mp_id)
+                    if superseded is not None:
+                        self._jobs.discard(
+                            (superseded.mp_id, superseded.commit))
+                        self._queue.task_done()
+                    self._waiting[job.mp_id] = job
+                    continue
+                self._running.add(job.mp_id)
+            try:
+                self._run(job)
+            except Exception as e:
+                print("** Tox job for repo {} branch {} failed: {} **".format(
+                    job.source_repo, job.source_branch, e))
+                self._set_error(job)
+            finally:
+                self._finish(job)
+
+    def _finish(self, job):
+        key = (job.mp_id, job.commit)
+        with self._lock:
+            self._running.discard(job.mp_id)
+            self._jobs.discard(key)
+            if self._latest.get(job.mp_id) == key:
+                del self._latest[job.mp_id]
+            waiting = self._waiting.pop(job.mp_id, None)
+        try:
+            if waiting is None:
+                self._copy_state(job)
+            else:
+                # The state of the previous commit is not shown
+                prep_tox_state(self.output_directory, job.mp_id)
+        except Exception as e:
+            print("** Could not set the tox state of repo {} branch {}: "
+                  "{} **".format(job.source_repo, job.source_branch, e))
+        if waiting is not None:
+            self._queue.put((-waiting.updated, next(self._order), waiting))
+            # The job was put again, so its first put is done
+            self._queue.task_done()
+        self._queue.task_done()
+
+    def _run(self, job):
+        process = self._context.Process(
+            target=run_tox_job,
+            args=(job.source_repo, job.source_branch, self.output_directory,
+                  job.mp_id, self.cache, self.mirrors))
+        start = time.perf_counter()
+        process.start()
+        process.join(self.timeout)
+        instrumentation.get_stats().add_phase(
+            'tox', time.perf_counter() - start)
+        if not process.is_alive():
+            return
+        print("TIMEOUT after {}s for repo {} branch {}".format(
+            self.timeout, job.source_repo, job.source_branch))
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+        process.join()
+        self._set_error(job)
+
+    def _set_error(self, job):
+        abs_vendor_path = os.path.join(os.path.dirname(
+            os.path.realpath(__file__)), "vendor")
+        publisher.copy_file(os.path.join(abs_vendor_path, "error.svg"),
+                            os.path.join(self.output_directory,
+                                         "{}.svg".format(job.mp_id)))
+
+    def _copy_state(self, job):
+        tox_state = os.path.join(self.output_directory,
+                                 "{}.svg".format(job.mp_id))
+        for output_directory in self.copy_directories:
+            publisher.copy_file(tox_state, os.path.join(
+                output_directory, "{}.svg".format(job.mp_id)))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The package lives under src/, run the tests against the checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,86 @@
+import os
+import threading
+
+import git
+import pytest
+
+from review_gator.git_mirror import GitMirrorCache
+
+
+def commit(repo, message):
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'Review Gator')
+        config.set_value('user', 'email', 'gator@example.com')
+    repo.git.commit('--allow-empty', '-m', message)
+    return repo.head.commit.hexsha
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Two source repositories, as (repo, file url) tuples."""
+    repos = []
+    for name in ('one', 'two'):
+        repo = git.Repo.init(str(tmp_path / name), initial_branch='main')
+        commit(repo, 'First commit of {}'.format(name))
+        repos.append((repo, (tmp_path / name).as_uri()))
+    return repos
+
+
+@pytest.fixture
+def mirrors(tmp_path):
+    # Every mirror but the one just fetched is over the size cap
+    return GitMirrorCache(str(tmp_path / 'mirrors'), max_size=0)
+
+
+def test_fetch_returns_the_branch_head(sources, mirrors):
+    repo, url = sources[0]
+    assert mirrors.fetch(url, 'main') == repo.head.commit.hexsha
+    head = commit(repo, 'Second commit')
+    assert mirrors.fetch(url, 'main') == head
+
+
+def test_worktree_is_checked_out_at_the_commit(sources, mirrors):
+    repo, url = sources[0]
+    first = mirrors.fetch(url, 'main')
+    commit(repo, 'Second commit')
+    mirrors.fetch(url, 'main')
+    with mirrors.worktree(url, first) as local_repo:
+        assert git.Repo(local_repo).head.commit.hexsha == first
+    assert not os.path.exists(local_repo)
+    # Only the bare mirror itself is left
+    worktrees = git.Git(mirrors._path(url)).worktree('list').splitlines()
+    assert len(worktrees) == 1
+
+
+def test_fetch_does_not_wait_for_a_running_worktree(sources, mirrors):
+    repo, url = sources[0]
+    first = mirrors.fetch(url, 'main')
+    head = commit(repo, 'Second commit')
+    fetched = []
+    with mirrors.worktree(url, first):
+        thread = threading.Thread(
+            target=lambda: fetched.append(mirrors.fetch(url, 'main')))
+        thread.start()
+        thread.join(30)
+        assert fetched == [head]
+
+
+def test_prune_keeps_mirrors_in_use(sources, mirrors):
+    (_, one), (_, two) = sources
+    head = mirrors.fetch(one, 'main')
+    with mirrors.worktree(one, head):
+        mirrors.fetch(two, 'main')
+        assert os.path.isdir(mirrors._path(one))
+    mirrors.fetch(two, 'main')
+    assert not os.path.isdir(mirrors._path(one))
+    assert os.path.isdir(mirrors._path(two))
+
+
+def test_prune_evicts_expired_mirrors(sources, tmp_path):
+    (_, one), (_, two) = sources
+    mirrors = GitMirrorCache(str(tmp_path / 'mirrors'), max_age=60)
+    mirrors.fetch(one, 'main')
+    os.utime(mirrors._path(one) + '.lock', (0, 0))
+    mirrors.fetch(two, 'main')
+    assert not os.path.isdir(mirrors._path(one))
+    assert os.path.isdir(mirrors._path(two))
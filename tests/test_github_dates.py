@@ -0,0 +1,27 @@
+import datetime
+
+import pytz
+
+from review_gator import review_gator
+
+
+NAIVE = datetime.datetime(2026, 1, 1, 12, 0)
+AWARE = datetime.datetime(2026, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_to_utc_localizes_naive_dates():
+    assert review_gator.to_utc(NAIVE) == pytz.utc.localize(NAIVE)
+
+
+def test_to_utc_converts_aware_dates():
+    plus_two = datetime.timezone(datetime.timedelta(hours=2))
+    date = review_gator.to_utc(AWARE.astimezone(plus_two))
+    assert date == AWARE
+    assert date.tzinfo is pytz.utc
+
+
+def test_pull_request_and_review_accept_pygithub_dates():
+    pr = review_gator.GithubPullRequest('url', 'title', 'owner', 'open',
+                                        AWARE, 2)
+    review = review_gator.GithubReview('url', 'owner', 'APPROVED', NAIVE)
+    assert pr.date == review.date == AWARE
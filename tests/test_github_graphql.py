@@ -0,0 +1,123 @@
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+
+from review_gator import github_graphql
+
+
+def get_review(number):
+    return {'url': 'https://github.com/org/repo/pull/1#review-{}'.format(
+                number),
+            'state': 'APPROVED' if number % 2 else 'COMMENTED',
+            'submittedAt': '2026-01-01T{:02d}:00:00Z'.format(number),
+            'author': {'login': 'reviewer{}'.format(number)},
+            'comments': {'nodes': []}}
+
+
+def get_page(nodes, cursor=None):
+    return {'pageInfo': {'hasNextPage': cursor is not None,
+                         'endCursor': cursor},
+            'nodes': nodes}
+
+
+def get_pull_request(number, reviews, cursor=None):
+    return {'id': 'PR_{}'.format(number),
+            'url': 'https://github.com/org/repo/pull/{}'.format(number),
+            'title': 'Pull request {}'.format(number),
+            'state': 'OPEN',
+            'createdAt': '2026-01-01T00:00:00Z',
+            'author': None,
+            'comments': {'nodes': [{'createdAt': '2026-01-02T00:00:00Z'}]},
+            'reviews': get_page(reviews, cursor)}
+
+
+class StubGraphQL(http.server.BaseHTTPRequestHandler):
+    """Answer each query with the next of the server's responses, recording
+    the queries."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])))
+        self.server.queries.append(body)
+        status, result = self.server.responses.pop(0)
+        data = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), StubGraphQL)
+    httpd.queries = []
+    httpd.responses = []
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server):
+    return github_graphql.GraphQLClient(
+        'token', 'http://127.0.0.1:{}/graphql'.format(server.server_port))
+
+
+def test_pull_requests_and_reviews_are_paginated(server, client):
+    server.responses = [
+        (200, {'data': {'r0': {
+            'url': 'https://github.com/org/repo',
+            'sshUrl': 'git@github.com:org/repo.git',
+            'pullRequests': get_page(
+                [get_pull_request(1, [get_review(1), get_review(2)],
+                                  'reviews-1')],
+                'pulls-1')}}}),
+        (200, {'data': {'node': {'reviews': get_page(
+            [get_review(3)], 'reviews-2')}}}),
+        (200, {'data': {'node': {'reviews': get_page([get_review(4)])}}}),
+        (200, {'data': {'repository': {'pullRequests': get_page(
+            [get_pull_request(2, [])])}}}),
+    ]
+    repos = github_graphql.get_all_repos(
+        client, {'org': {'repo': {'review-count': 2}}})
+
+    assert [query['variables'] for query in server.queries[1:]] == [
+        {'id': 'PR_1', 'cursor': 'reviews-1'},
+        {'id': 'PR_1', 'cursor': 'reviews-2'},
+        {'owner': 'org', 'name': 'repo', 'cursor': 'pulls-1'},
+    ]
+    assert client.query_count == 4
+    [repo] = repos
+    first, second = repo.pull_requests
+    assert [review.owner for review in first.reviews] == [
+        'reviewer1', 'reviewer2', 'reviewer3', 'reviewer4']
+    assert first.owner == 'ghost'
+    assert first.latest_activity.isoformat() == '2026-01-02T00:00:00+00:00'
+    assert second.reviews == []
+
+
+def test_errors_of_a_query_are_raised(server, client):
+    server.responses = [(200, {'data': None, 'errors': [
+        {'message': 'Could not resolve to a Repository'},
+        {'message': 'Something else'}]})]
+    with pytest.raises(github_graphql.GraphQLError) as error:
+        client.query('query { viewer { login } }')
+    assert str(error.value) == ('Could not resolve to a Repository; '
+                                'Something else')
+
+
+def test_http_errors_are_raised(server, client):
+    server.responses = [(502, {'message': 'Bad gateway'})]
+    with pytest.raises(requests.HTTPError):
+        github_graphql.get_all_repos(
+            client, {'org': {'repo': {'review-count': 2}}})
@@ -0,0 +1,95 @@
+import github
+import pytest
+
+from review_gator import ratelimit
+from review_gator import sessions
+
+
+class FakeGithub(object):
+    """A github client whose rate limit, as cached from the headers of its
+    last response, only changes when it makes a request."""
+
+    def __init__(self, remaining, resettime, limit=5000):
+        self.rate_limiting = (remaining, limit)
+        self.rate_limiting_resettime = resettime
+        # The rate limit github would report now
+        self.server = (remaining, limit, resettime)
+        self.rate_limit_checks = 0
+
+    def get_rate_limit(self):
+        self.rate_limit_checks += 1
+        remaining, limit, resettime = self.server
+        self.rate_limiting = (remaining, limit)
+        self.rate_limiting_resettime = resettime
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: now[0])
+    return now
+
+
+def test_call_stops_at_the_reserve(clock):
+    gh = FakeGithub(ratelimit.RESERVE, 2000)
+    scheduler = ratelimit.RateLimitScheduler(gh)
+    assert scheduler.call(lambda: 'fetched') is None
+    assert scheduler.exhausted
+
+
+def test_call_stops_once_the_rate_limit_is_exceeded(clock):
+    gh = FakeGithub(1000, 2000)
+    scheduler = ratelimit.RateLimitScheduler(gh)
+
+    def exceeded():
+        raise github.RateLimitExceededException(403, {}, {})
+
+    assert scheduler.call(exceeded) is None
+    assert scheduler.call(lambda: 'fetched') is None
+
+
+def test_exhausted_scheduler_recovers_after_reset(clock):
+    gh = FakeGithub(10, 2000)
+    scheduler = ratelimit.RateLimitScheduler(gh)
+    assert scheduler.call(lambda: 'fetched') is None
+    # The rate limit resets, but the client has no response to tell it
+    gh.server = (5000, 5000, 5600)
+    clock[0] = 2001.0
+    assert scheduler.call(lambda: 'fetched') == 'fetched'
+    assert not scheduler.exhausted
+    assert scheduler.remaining == 5000
+    assert scheduler.resettime == 5600
+
+
+def test_session_scheduler_is_replaced_after_reset(clock):
+    gh = FakeGithub(10, 2000)
+    api_sessions = sessions.Sessions(github_token='token')
+    api_sessions._github = gh
+    scheduler = api_sessions.github_rate_limit()
+    assert scheduler.call(lambda: 'fetched') is None
+    assert api_sessions.github_rate_limit() is scheduler
+
+    gh.server = (5000, 5000, 5600)
+    clock[0] = 2001.0
+    renewed = api_sessions.github_rate_limit()
+    assert renewed is not scheduler
+    assert renewed.call(lambda: 'fetched') == 'fetched'
+
+
+def test_refresh_updates_the_cached_rate_limit(clock):
+    gh = FakeGithub(10, 2000)
+    scheduler = ratelimit.RateLimitScheduler(gh)
+    gh.server = (3000, 5000, 2000)
+    scheduler.refresh()
+    assert scheduler.plan(['org/repo']) == {'org/repo'}
+
+
+def test_plan_follows_priority_within_the_budget(clock):
+    cost = ratelimit.estimate_requests(ratelimit.UNKNOWN_PULL_REQUESTS)
+    gh = FakeGithub(ratelimit.RESERVE + 2 * cost, 2000)
+    scheduler = ratelimit.RateLimitScheduler(gh)
+    scheduler.plan_ahead(['org/a', 'org/b', 'org/c'])
+    assert scheduler.plan(['org/a']) == {'org/a'}
+    assert scheduler.plan(['org/b']) == {'org/b'}
+    # Left out by the plan ahead, so it is not fetched
+    assert scheduler.plan(['org/c']) == set()
@@ -0,0 +1,109 @@
+import datetime
+import threading
+
+import pytest
+import pytz
+
+from review_gator import reporters
+
+NOW = pytz.utc.localize(datetime.datetime(2026, 1, 10))
+
+
+def get_reporter():
+    # Without an InfluxDB client, only its points are computed
+    reporter = reporters.InfluxDBTotalAgeReporter.__new__(
+        reporters.InfluxDBTotalAgeReporter)
+    reporter.metric_name = 'reviews'
+    return reporter
+
+
+def get_data():
+    return {'org/repo': {'pull_requests': [{
+        'date': NOW - datetime.timedelta(days=1),
+        'reviews': [{'state': 'APPROVED'}],
+    }]}}
+
+
+def test_points_of_a_config_are_tagged_with_its_name():
+    points = get_reporter()._get_points(NOW, get_data(), 'team')
+    assert [point['tags'] for point in points] == [
+        {'config': 'team', 'repo': 'org/repo'},
+        {'config': 'team', 'repo': 'org/repo', 'state': 'APPROVED'},
+        {'config': 'team'},
+    ]
+
+
+def test_points_of_a_single_config_are_not_tagged():
+    points = get_reporter()._get_points(NOW, get_data())
+    assert points[-1]['tags'] == {}
+    assert points[-1]['fields']['pull_requests'] == 1
+    assert points[-1]['fields']['total_age'] == 24 * 60 * 60
+
+
+class StubReporter(object):
+    """Record the batches sent, failing the first failures attempts, and
+    waiting for release before returning."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = 0
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def process_batch(self, batch):
+        self.attempts += 1
+        self.started.set()
+        self.release.wait(30)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('InfluxDB is down')
+        self.batches.append([data for _, data, _ in batch])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(reporters.time, 'sleep', delays.append)
+    return delays
+
+
+def test_dispatcher_drops_the_oldest_pending_report():
+    reporter = StubReporter()
+    reporter.release.clear()
+    dispatcher = reporters.ReporterDispatcher([reporter], max_pending=2)
+    dispatcher.submit('first', NOW)
+    assert reporter.started.wait(30)
+    for data in ('second', 'third', 'fourth'):
+        dispatcher.submit(data, NOW)
+    assert dispatcher.dropped == 1
+    reporter.release.set()
+    assert dispatcher.flush(30)
+    assert reporter.batches == [['first'], ['third', 'fourth']]
+
+
+def test_dispatcher_retries_with_backoff(sleeps):
+    reporter = StubReporter(failures=2)
+    dispatcher = reporters.ReporterDispatcher([reporter], retries=2,
+                                              backoff=1)
+    dispatcher.submit('report', NOW)
+    assert dispatcher.flush(30)
+    assert sleeps == [1, 2]
+    assert reporter.batches == [['report']]
+
+
+def test_dispatcher_drops_a_batch_after_its_retries(sleeps):
+    failing = StubReporter(failures=3)
+    working = StubReporter()
+    dispatcher = reporters.ReporterDispatcher([failing, working], retries=2,
+                                              backoff=1)
+    dispatcher.submit('lost', NOW)
+    assert dispatcher.flush(30)
+    assert failing.attempts == 3
+    assert failing.batches == []
+    # Other reporters and later reports are not held back
+    assert working.batches == [['lost']]
+    dispatcher.submit('sent', NOW)
+    assert dispatcher.flush(30)
+    assert failing.batches == [['sent']]
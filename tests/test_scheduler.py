@@ -0,0 +1,70 @@
+import datetime
+
+import pytz
+
+from review_gator import review_gator
+from review_gator import scheduler
+
+
+def get_config(review_count, tox=False, max_age=30):
+    return {
+        'github': {'repos': {'org': {'repo': {'review-count': review_count}}}},
+        'lp-git': {
+            'repos': {'lp:project': {'review-count': review_count,
+                                     'tox': tox}},
+            'owners': {'someone': {'max-age': max_age}},
+        },
+    }
+
+
+def test_sources_are_shared_whatever_their_settings():
+    entries, config_entries = scheduler.get_shared_entries(
+        [get_config(1), get_config(3, tox=True)],
+        review_gator.PROVIDER_SECTIONS, 600)
+    assert len(entries) == 3
+    first, second = config_entries
+    assert list(first) == list(second)
+    lp_repo = [entry for entry in entries
+               if entry.section == 'lp-git' and entry.kind == 'repos'][0]
+    # Collected for the config asking the most of it
+    assert scheduler.get_entry_data(lp_repo) == {'review-count': 3,
+                                                 'tox': True}
+    assert first[lp_repo] == {'review-count': 1, 'tox': False}
+    assert second[lp_repo] == {'review-count': 3, 'tox': True}
+
+
+def test_config_is_not_changed_by_sharing():
+    config = get_config(1)
+    scheduler.get_shared_entries([config, get_config(3, tox=True)],
+                                 review_gator.PROVIDER_SECTIONS, 600)
+    assert config == get_config(1)
+
+
+def test_owners_swept_over_different_ages_are_kept_apart():
+    entries, _ = scheduler.get_shared_entries(
+        [get_config(1, max_age=30), get_config(1, max_age=7)],
+        review_gator.PROVIDER_SECTIONS, 600)
+    assert len([entry for entry in entries if entry.kind == 'owners']) == 2
+
+
+def test_entries_repos_get_the_settings_of_their_config():
+    _, config_entries = scheduler.get_shared_entries(
+        [get_config(1), get_config(3, tox=True)],
+        review_gator.PROVIDER_SECTIONS, 600)
+    date = pytz.utc.localize(datetime.datetime(2026, 1, 1))
+    for entry in config_entries[0]:
+        repo = review_gator.LaunchpadRepo('url', entry.name)
+        repo.tox = entry.kind == 'repos'
+        repo.add(review_gator.LaunchpadPullRequest(
+            'url/' + entry.name, 'title', 'owner', 'Needs review', date, 3))
+        entry.repos = [repo]
+
+    first, second = [
+        review_gator.get_entries_repos(list(config), config)
+        for config in config_entries]
+    assert [repo.tox for repo in first] == [False, False, False]
+    assert [pr.review_count for repo in first
+            for pr in repo.pull_requests] == [1, 1, 3]
+    assert [repo.tox for repo in second] == [False, True, False]
+    assert [pr.review_count for repo in second
+            for pr in repo.pull_requests] == [3, 3, 3]
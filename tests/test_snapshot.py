@@ -0,0 +1,47 @@
+import datetime
+import json
+
+import pytz
+
+from review_gator import benchmark
+from review_gator import review_gator
+from review_gator import snapshot
+
+NOW = pytz.utc.localize(datetime.datetime(2026, 1, 10, 12, 0))
+
+
+def collect(gh, github_snapshot, incremental):
+    return review_gator.get_all_repos(gh, gh.sources['repos'],
+                                      snapshot=github_snapshot,
+                                      incremental=incremental)
+
+
+def test_incremental_refresh_compares_aware_dates(tmp_path):
+    path = str(tmp_path / 'github.json')
+    gh = benchmark.FakeGithub(2, 3, 1, 0, NOW)
+    github_snapshot = snapshot.GithubSnapshot(path)
+    collect(gh, github_snapshot, False)
+    github_snapshot.save()
+
+    github_snapshot = snapshot.GithubSnapshot(path)
+    updated_at = github_snapshot.updated_at('bench/repo0')
+    assert updated_at.tzinfo is not None
+    repos = collect(gh, github_snapshot, True)
+    assert [repo.pull_request_count for repo in repos] == [3, 3]
+    assert all(pr.date.tzinfo is pytz.utc
+               for repo in repos for pr in repo.pull_requests)
+
+
+def test_naive_snapshot_of_an_older_version_is_discarded(tmp_path):
+    path = tmp_path / 'github.json'
+    path.write_text(json.dumps({'version': 2, 'repos': {'bench/repo0': {
+        'updated_at': '2026-01-01T00:00:00.000000', 'pull_requests': {}}}}))
+    assert 'bench/repo0' not in snapshot.GithubSnapshot(str(path))
+
+
+def test_aware_dates_round_trip():
+    date = NOW.astimezone(datetime.timezone(datetime.timedelta(hours=-5)))
+    value = snapshot.format_aware_date(date)
+    assert value.endswith('+0000')
+    assert snapshot.parse_aware_date(value) == NOW
+    assert snapshot.format_aware_date(NOW.replace(tzinfo=None)) == value